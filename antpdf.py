@@ -6,8 +6,19 @@
 import sys
 import string
 
+import array
+import contextlib
+import gc
+import hashlib
 import io
+import multiprocessing
+import os
+import shutil
+import struct
+import time
 import PyPDF2
+from PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject,
+                            NameObject, NumberObject, StreamObject)
 import reportlab.pdfgen.canvas
 import reportlab.lib.colors as colors
 from reportlab.lib.fonts import addMapping
@@ -16,13 +27,87 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
 font_path = "/usr/share/fonts/truetype/culmus/MiriamMonoCLM-Bold.ttf"
-pdfmetrics.registerFont(TTFont('MiriamMonoCLM', font_path))
-addMapping('MiriamMonoCLM', 0, 0, 'MiriamMonoCLM') 
+
+class FontRegistry:
+    """Font specs 'fontname[/r,g,b,a]' resolved once per process.
+    TTF fonts, the default and those of config files, are registered
+    with reportlab on first use."""
+
+    def __init__(self):
+        self.paths = {'MiriamMonoCLM': font_path}
+        self.registered = set()
+        self.specs = {}
+        self.stamps = {}
+
+    def load_config(self, fn):
+        # Lines of: fontname ttf-path
+        f = open(fn, "r")
+        for line in f:
+            ss = line.split(None, 1)
+            if len(ss) == 2 and not ss[0].startswith('#'):
+                self.paths[ss[0]] = ss[1].strip()
+        f.close()
+
+    def register(self, name):
+        if name not in self.registered:
+            path = self.paths.get(name)
+            if path is not None:
+                pdfmetrics.registerFont(TTFont(name, path))
+                addMapping(name, 0, 0, name)
+            self.registered.add(name)
+
+    def resolve(self, spec: str) -> (str, colors.Color):
+        ret = self.specs.get(spec)
+        if ret is None:
+            ret = self.specs[spec] = self.parse(spec)
+            self.register(ret[0])
+        return ret
+
+    def stamp(self, spec: str) -> tuple:
+        # Identity of the TTF file a spec draws with, for cache keys:
+        # (path, size, mtime), None for reportlab's built-in fonts
+        name = self.parse(spec)[0]
+        ret = self.stamps.get(name)
+        if ret is None:
+            path = self.paths.get(name)
+            if path is not None:
+                st = os.stat(path)
+                ret = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+            self.stamps[name] = ret
+        return ret
+
+    def parse(self, font_name: str) -> (str, colors.Color):
+        color = colors.black
+        font_name_ss = font_name.split('/')
+        if len(font_name_ss) == 2:
+            color_ss = font_name_ss[1].split(',')
+            if len(color_ss) == 4:
+                font_name = font_name_ss[0]
+                factors = list(map(float, color_ss))
+                color = colors.Color(factors[0], factors[1], factors[2], factors[3])
+        return (font_name, color)
+
+font_registry = FontRegistry()
+
+def init_fonts(paths):
+    # Pool worker initializer, fonts of the parent's config files
+    font_registry.paths.update(paths)
 
 
 N_E = 6
 (E_PAGE, E_X, E_Y, E_FONT, E_SIZE, E_TEXT) = range(N_E)
 
+@contextlib.contextmanager
+def gc_paused():
+    # Bulk allocation of acyclic objects, collector passes are pure overhead
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 class AnnotationBase:
 
     def __init__(self, s, adef):
@@ -60,6 +145,10 @@ class Annotation(AnnotationBase):
                   self.v[E_FONT], sep, self.size, sep, self.v[E_TEXT]))
         return s
 
+    def key(self) -> tuple:
+        return ('text', self.x, self.y, self.v[E_FONT], self.size,
+                self.v[E_TEXT])
+
 class Blank(AnnotationBase):
 
     # 'blank:page:x:y:w:h'
@@ -79,6 +168,315 @@ class Blank(AnnotationBase):
         s = "blank:%d:%d:%d:%d" % (self.x, self.y, self.w, self.h)
         return s
 
+    def key(self) -> tuple:
+        return ('blank', self.x, self.y, self.w, self.h)
+
+class AnnotationTable:
+    """Annotations as column arrays, parsed from an annotations file
+    or loaded from its precompiled binary form.
+    For blanks, sizes and hs hold w and h, and font_ids is -1."""
+
+    MAGIC = b"ANTC\x01\n"
+    INT_COLUMNS = ('kinds', 'seps', 'pages', 'xs', 'ys', 'sizes', 'hs',
+                   'font_ids')
+    (K_TEXT, K_BLANK) = (0, 1)
+
+    def __init__(self):
+        for name in self.INT_COLUMNS:
+            setattr(self, name, array.array('i'))
+        self.text_offsets = array.array('q', [0])
+        self.texts = []
+        self.fonts = []
+        self.font_ids_map = {}
+        self.errors = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def font_id(self, font) -> int:
+        fid = self.font_ids_map.get(font)
+        if fid is None:
+            fid = self.font_ids_map[font] = len(self.fonts)
+            self.fonts.append(font)
+        return fid
+
+    def add_row(self, kind, sep, page, x, y, size, h, font_id, text):
+        self.kinds.append(kind)
+        self.seps.append(ord(sep))
+        self.pages.append(page)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.sizes.append(size)
+        self.hs.append(h)
+        self.font_ids.append(font_id)
+        self.texts.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+
+    def parse(self, fn):
+        f = open(fn, "r")
+        lines = f.read().split("\n")
+        f.close()
+        with gc_paused():
+            self.parse_lines(fn, lines)
+
+    def parse_lines(self, fn, lines):
+        kinds = self.kinds.append
+        seps = self.seps.append
+        pages = self.pages.append
+        xs = self.xs.append
+        ys = self.ys.append
+        sizes = self.sizes.append
+        hs = self.hs.append
+        font_ids = self.font_ids.append
+        texts = self.texts.append
+        offsets = self.text_offsets
+        offset = offsets[-1]
+        fids = self.font_ids_map
+        text_prev = None
+        blank_prev = None
+        for (ln, line) in enumerate(lines, 1):
+            if len(line) <= 2:
+                continue
+            try:
+                if line.startswith('blank:'):
+                    (kind, n_e, s) = (self.K_BLANK, 5, line[5:])
+                else:
+                    (kind, n_e, s) = (self.K_TEXT, N_E, line)
+                sep = s[0]
+                v = s[1:].split(sep)
+                if len(v) != n_e:
+                    raise ValueError("expected %d fields, got %d" %
+                                     (n_e, len(v)))
+                prev = blank_prev if kind == self.K_BLANK else text_prev
+                if prev is not None and "" in v:
+                    v = [(f if f != "" else prev[i]) for (i, f) in enumerate(v)]
+                try:
+                    spg = v[0]
+                    page = int(spg[1:]) if spg[:1] == '=' else int(spg) - 1
+                    x = int(v[1])
+                    y = int(v[2])
+                    if kind == self.K_BLANK:
+                        (size, h, fid, text) = (int(v[3]), int(v[4]), -1, "")
+                    else:
+                        (size, h, text) = (int(v[E_SIZE]), 0, v[E_TEXT])
+                        fid = fids.get(v[E_FONT])
+                        if fid is None:
+                            fid = self.font_id(v[E_FONT])
+                except ValueError:
+                    raise ValueError(self.bad_field(kind, v))
+            except ValueError as e:
+                self.errors.append("%s:%d: %s: '%s'" % (fn, ln, e, line))
+                continue
+            if kind == self.K_BLANK:
+                blank_prev = v
+            else:
+                text_prev = v
+            kinds(kind)
+            seps(ord(sep))
+            pages(page)
+            xs(x)
+            ys(y)
+            sizes(size)
+            hs(h)
+            font_ids(fid)
+            texts(text)
+            offset += len(text)
+            offsets.append(offset)
+
+    def bad_field(self, kind, v) -> str:
+        if kind == self.K_BLANK:
+            names = ("page", "x", "y", "w", "h")
+        else:
+            names = ("page", "x", "y", None, "size", None)
+        for (name, f) in zip(names, v):
+            if name == "page" and f.startswith('='):
+                f = f[1:]
+            if name is not None and not f.lstrip('-').isdigit():
+                return "bad %s: '%s'" % (name, f)
+        return "bad field"
+
+    def add_annotations(self, annotations):
+        for a in annotations:
+            if isinstance(a, Blank):
+                self.add_row(self.K_BLANK, a.sep, a.page, a.x, a.y, a.w, a.h,
+                             -1, "")
+            else:
+                self.add_row(self.K_TEXT, a.sep, a.page, a.x, a.y, a.size, 0,
+                             self.font_id(a.v[E_FONT]), a.v[E_TEXT])
+
+    def annotations(self) -> list:
+        with gc_paused():
+            return self.make_annotations()
+
+    def make_annotations(self) -> list:
+        ret = []
+        append = ret.append
+        blob = "".join(self.texts)
+        offsets = self.text_offsets
+        for (i, kind, sep, page, x, y, size, h, fid) in zip(
+                range(len(self)), self.kinds, self.seps, self.pages,
+                self.xs, self.ys, self.sizes, self.hs, self.font_ids):
+            if kind == self.K_BLANK:
+                a = Blank.__new__(Blank)
+                a.v = ["=%d" % page, str(x), str(y), str(size), str(h)]
+                (a.w, a.h) = (size, h)
+            else:
+                a = Annotation.__new__(Annotation)
+                a.v = ["=%d" % page, str(x), str(y), self.fonts[fid],
+                       str(size), blob[offsets[i]:offsets[i + 1]]]
+                a.size = size
+            a.sep = chr(sep)
+            (a.page, a.x, a.y) = (page, x, y)
+            append(a)
+        return ret
+
+    @classmethod
+    def is_compiled(cls, fn) -> bool:
+        f = open(fn, "rb")
+        magic = f.read(len(cls.MAGIC))
+        f.close()
+        return magic == cls.MAGIC
+
+    def save(self, fn):
+        fonts = "\0".join(self.fonts).encode('utf-8')
+        blob = "".join(self.texts).encode('utf-8')
+        f = open(fn, "wb")
+        f.write(self.MAGIC)
+        f.write(struct.pack("<qqq", len(self), len(fonts), len(blob)))
+        for name in self.INT_COLUMNS + ('text_offsets',):
+            self.write_array(f, getattr(self, name))
+        f.write(fonts)
+        f.write(blob)
+        f.close()
+
+    def load(self, fn):
+        f = open(fn, "rb")
+        f.read(len(self.MAGIC))
+        (n, n_fonts, n_blob) = struct.unpack("<qqq", f.read(24))
+        for name in self.INT_COLUMNS:
+            setattr(self, name, self.read_array(f, 'i', n))
+        self.text_offsets = self.read_array(f, 'q', n + 1)
+        fonts = f.read(n_fonts).decode('utf-8')
+        self.fonts = fonts.split("\0") if n_fonts > 0 else []
+        self.texts = [f.read(n_blob).decode('utf-8')]
+        f.close()
+
+    def write_array(self, f, a):
+        if sys.byteorder == 'big':
+            a = array.array(a.typecode, a)
+            a.byteswap()
+        f.write(a.tobytes())
+
+    def read_array(self, f, typecode, n):
+        a = array.array(typecode)
+        a.frombytes(f.read(n * a.itemsize))
+        if sys.byteorder == 'big':
+            a.byteswap()
+        return a
+
+class OverlayCache:
+    """Rendered overlay pages keyed by (page size, annotations,
+    font files).
+    Parsed pages are kept in memory for the run, the PDF bytes persist
+    in a directory, least recently used files are evicted."""
+
+    def __init__(self, dirname, max_entries):
+        self.dirname = dirname
+        self.max_entries = max_entries
+        self.pages = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(dirname, exist_ok=True)
+
+    # Bump when the key or the rendering changes
+    VERSION = 2
+
+    def path(self, key) -> str:
+        digest = hashlib.sha256(
+            repr((self.VERSION, key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.dirname, digest + ".pdf")
+
+    def get(self, key):
+        page = self.pages.get(key)
+        if page is None:
+            fn = self.path(key)
+            try:
+                f = open(fn, "rb")
+                data = f.read()
+                f.close()
+                os.utime(fn)
+                page = self.parse(key, data)
+            except OSError:
+                pass
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def put(self, key, data):
+        fn = self.path(key)
+        fn_tmp = "%s.%d" % (fn, os.getpid())
+        f = open(fn_tmp, "wb")
+        f.write(data)
+        f.close()
+        os.replace(fn_tmp, fn)
+        return self.parse(key, data)
+
+    def parse(self, key, data):
+        page = PyPDF2.PdfFileReader(io.BytesIO(data)).getPage(0)
+        self.pages[key] = page
+        return page
+
+    def evict(self):
+        entries = []
+        for fn in os.listdir(self.dirname):
+            if fn.endswith(".pdf"):
+                path = os.path.join(self.dirname, fn)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+        entries.sort()
+        for (mtime, path) in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def draw_blanks(can, annotations) -> bool:
+    drawn = False
+    for a in annotations:
+        if isinstance(a, Blank):
+            can.setFillColor(colors.white)
+            can.rect(a.x, a.y, a.w, a.h, stroke=0, fill=1)
+            drawn = True
+    return drawn
+
+def draw_texts(can, height, annotations) -> bool:
+    drawn = False
+    for a in annotations:
+        if isinstance(a, Annotation):
+            (font_name, color) = font_registry.resolve(a.v[E_FONT])
+            can.setFillColor(color)
+            can.setFont(font_name, int(a.size))
+            y = a.y
+            if y < 0:
+                y += height
+            can.drawString(a.x, y, a.v[E_TEXT])
+            drawn = True
+    return drawn
+
+def render_overlay(job) -> bytes:
+    # One page overlay, blanks under texts. Also the -j pool worker
+    (width, height, annotations) = job
+    packet = io.BytesIO()
+    can = reportlab.pdfgen.canvas.Canvas(packet, pagesize=(width, height))
+    draw_blanks(can, annotations)
+    draw_texts(can, height, annotations)
+    can.save()
+    return packet.getvalue()
+
 class AntPDF:
     
     def usage(self):
@@ -88,13 +486,35 @@ Usage:
    [-h | -help | --help]          # This message
    [-a :page:x:y:font:size:text]  # Repeatable
    [-i <Annotations-Filename>]    # File with values as for '-a' option'[
+                                  # or precompiled by '-w'
+   [-w <Compiled-Filename>]       # Precompile the annotations,
+                                  # PDF filenames are then optional
+   [-s]                           # Single pass: one overlay document,
+                                  # each font embedded once
+   [-u]                           # Incremental update: append only
+                                  # annotated pages to a copy of in.pdf
+   [-f <fonts-config>]            # Lines of: fontname ttf-path
+   [-j <N>]                       # Render page overlays in N processes,
+                                  # not with -s or -c
+   [-c <cache-dir>]               # Reuse overlays of identical pages,
+                                  # persistent (-s is ignored)
+   [-C <cache-max-entries>]       # Default: 1000
+   [-e]                           # Strict: reject annotation files
+                                  # with bad lines, rather than skip them
+   [-q]                           # Quiet
    <in.pdf> <out.pdf>
+ or
+ %s
+   [-s] [-u] [-e] [-f <fonts-config>]
+   [-c <cache-dir>] [-C <cache-max-entries>]  # For each job
+   [-n <processes>]               # Default: number of CPUs
+   -b <manifest>                  # Lines of: in.pdf out.pdf annotations-file
 
    Page-numbers start with 1. If preceded by '=' then (Dijkstra) start with 0.
    y coordinates grow up. If negative grow down.
    if font contaings '/' (slash) then it is fontname/color,
    where color is given as r,g,b,a
-"""[1:] % self.argv[0])
+"""[1:] % (self.argv[0], self.argv[0]))
 
     def error(self, msg):
         sys.stderr.write("%s\n" % msg)
@@ -106,11 +526,35 @@ Usage:
         self.rc = 0
         self.helped = False
         self.annotations = []
+        self.single_pass = False
+        self.overlays = None
+        self.njobs = None
+        self.pool = None
+        self.overlay_stream = None
+        self.incremental = False
+        self.updated_pages = []
+        self.font_files = {}
+        self.font_bytes_per_page = 0
+        self.quiet = False
+        self.strict = False
+        self.bad_lines = []
+        self.cache_dir = None
+        self.cache_max = 1000
+        self.cache = None
+        self.fn_manifest = None
+        self.fn_compiled = None
+        self.fn_in = None
+        self.nprocs = os.cpu_count()
+        self.job_flags = []
         ai = 1
         annotation_last = None
-        while self.may_run() and ai < len(argv) - 2:
+        while self.may_run() and ai < len(argv) and argv[ai].startswith('-'):
             opt = argv[ai]
-            if opt in ('-h', '-help', '--help'):
+            if (opt in ('-a', '-i', '-w', '-f', '-j', '-b', '-n', '-c', '-C')
+                    and
+                    ai + 1 == len(argv)):
+                self.error("Missing value for option: '%s'" % opt)
+            elif opt in ('-h', '-help', '--help'):
                 self.usage()
                 self.helped = True
             elif opt == '-a':
@@ -122,12 +566,58 @@ Usage:
             elif opt == '-i':
                 ai += 1
                 self.fget_annotations(argv[ai])
+            elif opt == '-w':
+                ai += 1
+                self.fn_compiled = argv[ai]
+            elif opt == '-s':
+                self.single_pass = True
+                self.job_flags.append(opt)
+            elif opt == '-u':
+                self.incremental = True
+                self.job_flags.append(opt)
+            elif opt == '-e':
+                self.strict = True
+                self.job_flags.append(opt)
+            elif opt == '-q':
+                self.quiet = True
+            elif opt == '-f':
+                ai += 1
+                font_registry.load_config(argv[ai])
+                self.job_flags += [opt, argv[ai]]
+            elif opt == '-j':
+                ai += 1
+                self.njobs = max(1, int(argv[ai]))
+            elif opt == '-c':
+                ai += 1
+                self.cache_dir = argv[ai]
+                self.job_flags += [opt, argv[ai]]
+            elif opt == '-C':
+                ai += 1
+                self.cache_max = int(argv[ai])
+                self.job_flags += [opt, argv[ai]]
+            elif opt == '-b':
+                ai += 1
+                self.fn_manifest = argv[ai]
+            elif opt == '-n':
+                ai += 1
+                self.nprocs = int(argv[ai])
             else:
                 self.error("Bad option: '%s'" % opt)
             ai += 1
+        if (self.njobs is not None and
+                (self.single_pass or self.cache_dir is not None) and
+                self.may_run()):
+            self.error("-j cannot be combined with -s or -c")
+        if self.strict and len(self.bad_lines) > 0 and self.may_run():
+            self.error("%d bad annotation lines" % len(self.bad_lines))
         if self.may_run():
-            if len(self.annotations) == 0 :
+            if self.fn_manifest is not None:
+                if ai != len(argv):
+                    self.error("Unexpected arguments in batch mode")
+            elif len(self.annotations) == 0 :
                 self.error("Missing annotations")
+            elif self.fn_compiled is not None and ai == len(argv):
+                pass
             elif len(argv) != ai + 2:
                 self.error("Missing PDF filenames")
             else:
@@ -138,108 +628,357 @@ Usage:
         return self.rc == 0 and not self.helped
 
     def fget_annotations(self, fn):
-        f = open(fn, "r")
-        a = b = None
-        for line in f:
-            if line.endswith("\n"):
-                line = line[:-1]
-            if len(line) > 2:
-                if line.startswith('blank:'):
-                    b_new = Blank(line[5:], b)
-                    b = b_new
-                    self.annotations.append(b)
-                else:
-                    a_new = Annotation(line, a)
-                    if a_new.ok():
-                        a = a_new
-                        self.annotations.append(a)
-        f.close()
+        table = AnnotationTable()
+        if AnnotationTable.is_compiled(fn):
+            table.load(fn)
+        else:
+            table.parse(fn)
+        # Bad lines are skipped, as ever, unless -e rejects them
+        for e in table.errors:
+            sys.stderr.write("%s\n" % e)
+        self.bad_lines += table.errors
+        self.annotations += table.annotations()
+
+    def write_compiled(self):
+        table = AnnotationTable()
+        table.add_annotations(self.annotations)
+        table.save(self.fn_compiled)
+        self.verbose("%s: %d annotations" % (self.fn_compiled, len(table)))
 
 
     def run(self):
-        # Assume annotations are sorted
-        self.annotations.sort(key=(lambda a: (a.page, a.y, a.x)))
         self.pdfin = PyPDF2.PdfFileReader(open(self.fn_in, "rb"))
         self.pdfout = PyPDF2.PdfFileWriter()
+        if self.incremental and self.pdfin.isEncrypted:
+            self.error("Incremental update of encrypted PDF not supported")
+            return
         npages_in = self.pdfin.getNumPages()
         self.verbose("%s has %d pages" % (self.fn_in, npages_in))
-        ai = 0
+        page_annotations = self.index_annotations(npages_in)
+        if self.cache_dir is not None:
+            self.cache = OverlayCache(self.cache_dir, self.cache_max)
+        elif self.single_pass:
+            self.render_overlays(page_annotations)
+        elif self.njobs is not None:
+            self.start_overlays(page_annotations)
         pi = 0
-        while pi < npages_in:
-            copy_end = npages_in
-            if ai < len(self.annotations):
-                if self.annotations[ai].page < copy_end:
-                    copy_end = self.annotations[ai].page
-            while pi < copy_end:
-                self.verbose("copy page pi=%d" % pi)
+        for pa in sorted(page_annotations):
+            self.copy_pages(pi, pa)
+            self.annotate(pa, page_annotations[pa])
+            pi = pa + 1
+        self.copy_pages(pi, npages_in)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        if self.incremental:
+            self.write_incremental()
+        else:
+            outputStream = open(self.fn_out, "wb")
+            self.pdfout.write(outputStream)
+            outputStream.close()
+        font_bytes = sum(self.font_files.values())
+        self.verbose("font data: %d bytes embedded, %d duplicated bytes "
+                     "avoided" % (font_bytes,
+                                  self.font_bytes_per_page - font_bytes))
+        if self.cache is not None:
+            self.cache.evict()
+            self.verbose("overlay cache: hits=%d misses=%d" %
+                         (self.cache.hits, self.cache.misses))
+
+    def write_incremental(self):
+        # Copy in.pdf as is, then append the annotated page objects, the
+        # objects they newly refer to, a new xref section and a trailer
+        # whose /Prev links to the original cross reference.
+        startxref = self.get_startxref(self.fn_in)
+        size = int(self.pdfin.trailer['/Size'])
+        self.next_idnum = size
+        self.remap = {}
+        objects = []
+        for page in self.updated_pages:
+            ref = page.indirectRef
+            objects.append((ref.idnum, ref.generation,
+                            self.sweep(page, objects)))
+        objects.sort(key=(lambda o: o[0]))
+        fout = open(self.fn_out, "wb")
+        fin = open(self.fn_in, "rb")
+        shutil.copyfileobj(fin, fout, 1 << 20)
+        fin.close()
+        fout.write(b"\n")
+        positions = []
+        for (idnum, generation, obj) in objects:
+            positions.append(fout.tell())
+            fout.write(b"%d %d obj\n" % (idnum, generation))
+            obj.writeToStream(fout, None)
+            fout.write(b"\nendobj\n")
+        xref_location = fout.tell()
+        fout.write(b"xref\n")
+        oi = 0
+        while oi < len(objects):
+            oe = oi + 1
+            while (oe < len(objects) and
+                   objects[oe][0] == objects[oe - 1][0] + 1):
+                oe += 1
+            fout.write(b"%d %d\n" % (objects[oi][0], oe - oi))
+            for (idnum, generation, obj) in objects[oi:oe]:
+                fout.write(b"%010d %05d n \n" % (positions[oi], generation))
+                oi += 1
+        trailer = DictionaryObject()
+        trailer[NameObject("/Size")] = NumberObject(self.next_idnum)
+        trailer[NameObject("/Prev")] = NumberObject(startxref)
+        for key in ("/Root", "/Info", "/ID"):
+            if key in self.pdfin.trailer:
+                trailer[NameObject(key)] = self.pdfin.trailer.raw_get(key)
+        fout.write(b"trailer\n")
+        trailer.writeToStream(fout, None)
+        fout.write(b"\nstartxref\n%d\n%%%%EOF\n" % xref_location)
+        fout.close()
+        self.verbose("appended %d objects for %d pages" %
+                     (len(objects), len(self.updated_pages)))
+
+    def sweep(self, obj, objects):
+        # Renumber references into other PDFs (the overlays) as new objects
+        # following in.pdf's, streams must be indirect objects as well.
+        if isinstance(obj, DictionaryObject):
+            for (key, value) in list(obj.items()):
+                obj[key] = self.sweep_value(value, objects)
+        elif isinstance(obj, ArrayObject):
+            for i in range(len(obj)):
+                obj[i] = self.sweep_value(obj[i], objects)
+        elif isinstance(obj, IndirectObject) and obj.pdf is not self.pdfin:
+            key = (id(obj.pdf), obj.generation, obj.idnum)
+            ref = self.remap.get(key)
+            if ref is None:
+                ref = self.new_object(obj.getObject(), objects)
+                self.remap[key] = ref
+            obj = ref
+        return obj
+
+    def sweep_value(self, value, objects):
+        value = self.sweep(value, objects)
+        if isinstance(value, StreamObject):
+            value = self.new_object(value, objects)
+        return value
+
+    def new_object(self, obj, objects) -> IndirectObject:
+        ref = IndirectObject(self.next_idnum, 0, self.pdfin)
+        self.next_idnum += 1
+        objects.append((ref.idnum, 0, None))
+        oi = len(objects) - 1
+        objects[oi] = (ref.idnum, 0, self.sweep(obj, objects))
+        return ref
+
+    def get_startxref(self, fn) -> int:
+        f = open(fn, "rb")
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 1024))
+        tail = f.read()
+        f.close()
+        ss = tail[tail.rindex(b"startxref") + len(b"startxref"):].split()
+        return int(ss[0])
+
+    def index_annotations(self, npages_in) -> dict:
+        # page -> annotations, each page's in (y, x) drawing order
+        page_annotations = {}
+        for a in self.annotations:
+            if 0 <= a.page < npages_in:
+                page_annotations.setdefault(a.page, []).append(a)
+        for annotations in page_annotations.values():
+            annotations.sort(key=(lambda a: (a.y, a.x)))
+        return page_annotations
+
+    def copy_pages(self, pi_b, pi_e):
+        # Unannotated pages, as is. Their cost is PyPDF2 reading the page
+        # tree and writing every object, not these addPage calls
+        if pi_b < pi_e and not self.incremental:
+            self.verbose("copy pages [%d, %d)" % (pi_b, pi_e))
+            for pi in range(pi_b, pi_e):
                 self.pdfout.addPage(self.pdfin.getPage(pi))
-                pi += 1
-            ai_b = ai
-            while ai < len(self.annotations) and self.annotations[ai].page == pi:
-                ai += 1
-            ai_e = ai
-            if (ai_b < ai_e):
-                self.annotate(pi, ai_b, ai_e)
-                pi += 1
-        outputStream = open(self.fn_out, "wb")
-        self.pdfout.write(outputStream)
-        outputStream.close()
-
-    def annotate(self, pi, ai_b, ai_e):
-        self.verbose("annotate(pi=%d, ai_b=%d, ai_e=%d)" % (pi, ai_b, ai_e))
+
+    def render_overlays(self, page_annotations):
+        # All annotated pages drawn into one overlay document, parsed once
+        packet = io.BytesIO()
+        can = reportlab.pdfgen.canvas.Canvas(packet)
+        pis = sorted(page_annotations)
+        for pi in pis:
+            annotations = page_annotations[pi]
+            (width, height) = self.page_size(self.pdfin.getPage(pi))
+            can.setPageSize((width, height))
+            draw_blanks(can, annotations)
+            draw_texts(can, height, annotations)
+            can.showPage()
+        self.overlays = {}
+        if len(pis) > 0:
+            can.save()
+            packet.seek(0)
+            ann_pdf = PyPDF2.PdfFileReader(packet)
+            for (oi, pi) in enumerate(pis):
+                self.overlays[pi] = ann_pdf.getPage(oi)
+        self.verbose("rendered %d overlay pages" % len(pis))
+
+    def start_overlays(self, page_annotations):
+        # Overlays rendered ahead, consumed in page order by annotate
+        jobs = [self.page_size(self.pdfin.getPage(pi)) +
+                (page_annotations[pi],) for pi in sorted(page_annotations)]
+        if self.njobs > 1:
+            self.pool = multiprocessing.Pool(
+                self.njobs, initializer=init_fonts,
+                initargs=(font_registry.paths,))
+            chunksize = max(1, len(jobs) // (4 * self.njobs))
+            self.overlay_stream = self.pool.imap(
+                render_overlay, jobs, chunksize)
+        else:
+            self.overlay_stream = map(render_overlay, jobs)
+
+    def annotate(self, pi, annotations):
+        self.verbose("annotate(pi=%d, #=%d)" % (pi, len(annotations)))
         page = self.pdfin.getPage(pi)
+        (width, height) = self.page_size(page)
+        self.verbose("page=%d wh=[%d x %d]" % (pi, width, height))
+        if self.overlays is not None:
+            self.merge_overlay(page, self.overlays[pi])
+        elif self.cache is not None:
+            self.merge_overlay(
+                page, self.cached_overlay(width, height, annotations))
+        elif self.overlay_stream is not None:
+            data = next(self.overlay_stream)
+            ann_pdf = PyPDF2.PdfFileReader(io.BytesIO(data))
+            self.merge_overlay(page, ann_pdf.getPage(0))
+        else:
+            for ba_pass in (0, 1):
+                packet = io.BytesIO()
+                can = reportlab.pdfgen.canvas.Canvas(
+                    packet, pagesize=(width, height))
+                # self.verbose("Canvas Fonts: %s" % str(can.getAvailableFonts()))
+                if ba_pass == 0:
+                    merge_needed = draw_blanks(can, annotations)
+                else:
+                    merge_needed = draw_texts(can, height, annotations)
+                if merge_needed:
+                    can.save()
+                    packet.seek(0)
+                    ann_pdf = PyPDF2.PdfFileReader(packet)
+                    self.merge_overlay(page, ann_pdf.getPage(0))
+        if self.incremental:
+            self.updated_pages.append(page)
+        else:
+            self.pdfout.addPage(page)
+
+    def merge_overlay(self, page, overlay):
+        # Account the embedded font files, shared ones are written once
+        fonts = overlay['/Resources'].get('/Font')
+        fonts = {} if fonts is None else fonts.getObject()
+        for font in fonts.values():
+            descriptor = font.getObject().get('/FontDescriptor')
+            if descriptor is not None:
+                descriptor = descriptor.getObject()
+                for ff in ('/FontFile', '/FontFile2', '/FontFile3'):
+                    ref = descriptor.raw_get(ff) if ff in descriptor else None
+                    if isinstance(ref, IndirectObject):
+                        # PyPDF2 drops /Length, _data is the encoded stream
+                        n = len(ref.getObject()._data)
+                        self.font_files[(id(ref.pdf), ref.idnum)] = n
+                        self.font_bytes_per_page += n
+        page.mergePage(overlay)
+
+    def cached_overlay(self, width, height, annotations):
+        # The font files too, -f may map a name to another TTF
+        fonts = sorted(set(a.v[E_FONT] for a in annotations
+                           if isinstance(a, Annotation)))
+        key = (width, height, tuple(a.key() for a in annotations),
+               tuple((spec, font_registry.stamp(spec)) for spec in fonts))
+        overlay = self.cache.get(key)
+        if overlay is None:
+            data = render_overlay((width, height, annotations))
+            overlay = self.cache.put(key, data)
+        return overlay
+
+    def page_size(self, page) -> (int, int):
         box = page.mediaBox
         width = int(box[2] - box[0])
         height = int(box[3] - box[1])
-        self.verbose("page=%d wh=[%d x %d]" % (pi, width, height))
-        annotations = []
-        blankss = []
-        for ba_pass in (0, 1):
-            packet = io.BytesIO()
-            can = reportlab.pdfgen.canvas.Canvas(
-                packet, pagesize=(width, height))
-            # self.verbose("Canvas Fonts: %s" % str(can.getAvailableFonts()))
-            merge_needed = False
-            for ai in range(ai_b, ai_e):
-                a = self.annotations[ai]
-                if isinstance(a, Blank) and ba_pass == 0:
-                    sys.stderr.write('Blank: %s\n' % a)
-                    can.setFillColor(colors.white)
-                    can.rect(a.x, a.y, a.w, a.h, stroke=0, fill=1)
-                    merge_needed = True
-                if isinstance(a, Annotation) and ba_pass == 1:
-                    (font_name, color) = self.get_font_color(a.v[E_FONT])
-                    can.setFillColor(color)
-                    can.setFont(font_name, int(a.size))
-                    y = a.y
-                    if y < 0:
-                        y += height
-                    can.drawString(a.x, y, a.v[E_TEXT])
-                    merge_needed = True
-            if merge_needed:
-                can.save()
-                packet.seek(0)
-                ann_pdf = PyPDF2.PdfFileReader(packet)
-                page.mergePage(ann_pdf.getPage(0))
-        self.pdfout.addPage(page)
-        
-    def get_font_color(self, font_name: str) -> (str, colors.Color):
-        color = colors.black
-        font_name_ss = font_name.split('/')
-        if len(font_name_ss) == 2:
-            color_ss = font_name_ss[1].split(',')
-            if len(color_ss) == 4:
-                font_name = font_name_ss[0]
-                factors = list(map(float, color_ss))
-                color = colors.Color(factors[0], factors[1], factors[2], factors[3])
-        return (font_name, color)
+        return (width, height)
 
     def verbose(self, msg):
-        sys.stderr.write("%s\n" % msg)
+        if not self.quiet:
+            sys.stderr.write("%s\n" % msg)
+
+    def run_batch(self):
+        jobs = self.read_manifest()
+        if not self.may_run():
+            return
+        t0 = time.time()
+        n_ok = 0
+        n_pages = 0
+        pool = multiprocessing.Pool(self.nprocs)
+        for (ln, argv, rc, npages, dt, err) in pool.imap_unordered(
+                batch_job, jobs):
+            if rc == 0:
+                n_ok += 1
+                n_pages += npages
+                sys.stdout.write("OK   %s:%d: %s -> %s  %d pages %.3fs\n" %
+                                 (self.fn_manifest, ln, argv[-2], argv[-1],
+                                  npages, dt))
+            else:
+                sys.stdout.write("FAIL %s:%d: %s -> %s  %s\n" %
+                                 (self.fn_manifest, ln, argv[-2], argv[-1],
+                                  err))
+        pool.close()
+        pool.join()
+        dt = time.time() - t0
+        sys.stdout.write(
+            "%d/%d jobs OK, %d pages in %.2fs: %.1f jobs/sec %.1f pages/sec\n"
+            % (n_ok, len(jobs), n_pages, dt, len(jobs) / max(dt, 1e-9),
+               n_pages / max(dt, 1e-9)))
+        if n_ok < len(jobs):
+            self.rc = 1
+
+    def read_manifest(self) -> list:
+        jobs = []
+        f = open(self.fn_manifest, "r")
+        for (ln, line) in enumerate(f, 1):
+            ss = line.split()
+            if len(ss) == 0 or ss[0].startswith('#'):
+                continue
+            if len(ss) != 3:
+                self.error("%s:%d: expected: in.pdf out.pdf annotations-file"
+                           % (self.fn_manifest, ln))
+                break
+            (fn_in, fn_out, fn_ann) = ss
+            argv = ([self.argv[0], '-q'] + self.job_flags +
+                    ['-i', fn_ann, fn_in, fn_out])
+            jobs.append((ln, argv))
+        f.close()
+        return jobs
+
+
+def batch_job(job):
+    (ln, argv) = job
+    t0 = time.time()
+    npages = 0
+    err = None
+    try:
+        ant = AntPDF(argv)
+        if ant.may_run():
+            ant.run()
+        if ant.rc == 0:
+            npages = ant.pdfin.getNumPages()
+        else:
+            err = "rc=%d" % ant.rc
+        rc = ant.rc
+    except Exception as e:
+        rc = 1
+        err = "%s: %s" % (e.__class__.__name__, e)
+    return (ln, argv, rc, npages, time.time() - t0, err)
 
 
 if __name__ == '__main__':
     ant = AntPDF(sys.argv)
     if ant.may_run():
-        ant.run()
+        if ant.fn_manifest is not None:
+            ant.run_batch()
+        else:
+            if ant.fn_compiled is not None:
+                ant.write_compiled()
+            if ant.fn_in is not None:
+                ant.run()
     sys.exit(ant.rc)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Benchmark antpdf.py on sparse annotations: the page index against the
+# old sort-then-scan loop (on par, not a speedup), and -u incremental output
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import PyPDF2
+import reportlab.pdfgen.canvas
+
+import antpdf
+
+ow = sys.stdout.write
+
+
+def make_pdf(fn, npages):
+    can = reportlab.pdfgen.canvas.Canvas(fn, pagesize=(595, 842))
+    for pi in range(npages):
+        can.drawString(100, 700, "Page %d" % (pi + 1))
+        can.showPage()
+    can.save()
+
+
+def legacy_run(ant):
+    # The sort-then-scan loop antpdf.py used before the page index
+    ant.annotations.sort(key=(lambda a: (a.page, a.y, a.x)))
+    ant.pdfin = PyPDF2.PdfFileReader(open(ant.fn_in, "rb"))
+    ant.pdfout = PyPDF2.PdfFileWriter()
+    npages_in = ant.pdfin.getNumPages()
+    ai = 0
+    pi = 0
+    while pi < npages_in:
+        copy_end = npages_in
+        if ai < len(ant.annotations):
+            if ant.annotations[ai].page < copy_end:
+                copy_end = ant.annotations[ai].page
+        while pi < copy_end:
+            ant.verbose("copy page pi=%d" % pi)
+            ant.pdfout.addPage(ant.pdfin.getPage(pi))
+            pi += 1
+        ai_b = ai
+        while ai < len(ant.annotations) and ant.annotations[ai].page == pi:
+            ai += 1
+        ai_e = ai
+        if (ai_b < ai_e):
+            ant.annotate(pi, ant.annotations[ai_b:ai_e])
+            pi += 1
+    outputStream = open(ant.fn_out, "wb")
+    ant.pdfout.write(outputStream)
+    outputStream.close()
+
+
+def bench(fn_in, fn_out, nstamps, npages, repeat):
+    argv = ["antpdf", "-q"]
+    step = max(1, npages // nstamps)
+    for si in range(nstamps):
+        argv += ["-a", ":%d:100:100:MiriamMonoCLM:12:stamp%d" %
+                 (1 + si * step, si)]
+    argv += [fn_in, fn_out]
+    times = {}
+    for (name, run, flags) in (
+            ("legacy", legacy_run, []),
+            ("index", antpdf.AntPDF.run, []),
+            ("index-u", antpdf.AntPDF.run, ["-u"])):
+        best = None
+        for r in range(repeat):
+            ant = antpdf.AntPDF(argv[:1] + flags + argv[1:])
+            t0 = time.time()
+            run(ant)
+            dt = time.time() - t0
+            best = dt if best is None else min(best, dt)
+        times[name] = best
+        ow("%-8s %8.3fs\n" % (name, best))
+    ow("index / legacy time: %.2f\n" % (times["index"] / times["legacy"]))
+    ow("speedup index-u: %.2fx\n" % (times["legacy"] / times["index-u"]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        "antpdfbench", "Benchmark antpdf on sparse annotations",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-p", "--pages", type=int, default=10000,
+                        help="Number of pages")
+    parser.add_argument("-s", "--stamps", type=int, default=5,
+                        help="Number of annotated pages")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Best of repeated runs")
+    args = parser.parse_args(argv[1:])
+    tmpdir = tempfile.mkdtemp(prefix="antpdfbench-")
+    fn_in = os.path.join(tmpdir, "in.pdf")
+    fn_out = os.path.join(tmpdir, "out.pdf")
+    make_pdf(fn_in, args.pages)
+    ow("%d pages, %d stamps\n" % (args.pages, args.stamps))
+    bench(fn_in, fn_out, args.stamps, args.pages, args.repeat)
+    os.unlink(fn_in)
+    os.unlink(fn_out)
+    os.rmdir(tmpdir)
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main(sys.argv)
+    sys.exit(rc)
@@ -1,9 +1,22 @@
 #!/usr/bin/env python
 #  Combinatoric functions
 
+from array import array
+import bisect
+import importlib
+import itertools
+import multiprocessing
+import random
+import struct
 import sys
+import time
 from typing import List
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def gcd(m, n):
    while n:
@@ -17,13 +30,55 @@ def lcm(m, n):
     return (m*n)/gcd(m, n)
 
 
-def factorial(n):
+def factorial_simple(n):
     ret = 1
     while n > 1:
         ret *= n
         n -= 1
     return ret
-    
+
+
+def range_product(lo, hi):
+    "lo * (lo+1) * ... * (hi-1), by binary splitting"
+    if hi - lo <= 16:
+        ret = 1
+        for m in range(lo, hi):
+            ret *= m
+    else:
+        mid = (lo + hi) // 2
+        ret = range_product(lo, mid) * range_product(mid, hi)
+    return ret
+
+
+def factorial(n):
+    return range_product(2, n + 1) if n > 1 else 1
+
+
+def product(factors):
+    "Balanced product tree, big factors are multiplied late"
+    factors = list(factors)
+    while len(factors) > 1:
+        tail = [factors[-1]] if len(factors) % 2 else []
+        factors = [factors[i] * factors[i + 1]
+                   for i in range(0, len(factors) - 1, 2)] + tail
+    return factors[0] if factors else 1
+
+
+sieve_primes = []
+sieve_limit = 1
+
+def primes_upto(n) -> List[int]:
+    global sieve_primes, sieve_limit
+    if n > sieve_limit:
+        sieve_limit = max(n, 2*sieve_limit)
+        sieve = bytearray([1]) * (sieve_limit + 1)
+        sieve[0:2] = b"\0\0"
+        for p in range(2, int(sieve_limit**0.5) + 1):
+            if sieve[p]:
+                sieve[p*p::p] = bytes(len(range(p*p, sieve_limit + 1, p)))
+        sieve_primes = [p for p in range(sieve_limit + 1) if sieve[p]]
+    return sieve_primes[:bisect.bisect_right(sieve_primes, n)]
+
 
 def next_permutation(a):
     n = len(a)
@@ -47,7 +102,59 @@ def next_permutation(a):
     return a
 
 
+def next_permutation_inplace(a) -> bool:
+    """Step a to its lexicographic successor, in place, by a swap and a
+    tail reversal. Return False, leaving a unchanged, after the last."""
+    j = len(a) - 2
+    while j >= 0 and a[j] >= a[j + 1]:
+        j -= 1
+    if j < 0:
+        return False
+    l = len(a) - 1
+    while a[j] >= a[l]:
+        l -= 1
+    (a[j], a[l]) = (a[l], a[j])
+    a[j + 1:] = a[:j:-1]
+    return True
+
+
+# Pascal triangle rows, grown on demand up to CHOOSE_TABLE_MAX_N
+CHOOSE_TABLE_MAX_N = 256
+pascal_rows = [[1]]
+
 def choose(n, k):
+    if k < 0 or k > n:
+        return 0
+    if n <= CHOOSE_TABLE_MAX_N:
+        while len(pascal_rows) <= n:
+            row = pascal_rows[-1]
+            pascal_rows.append([1] + [a + b for (a, b) in zip(row, row[1:])]
+                               + [1])
+        return pascal_rows[n][k]
+    return choose_primes(n, k)
+
+
+def choose_primes(n, k):
+    "By prime factorization, Legendre exponents of n! / (k! (n-k)!)"
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n - k)
+    factors = []
+    for p in primes_upto(n):
+        if p > n - k:
+            factors.append(p)  # exponent is 1
+            continue
+        e = 0
+        pp = p
+        while pp <= n:
+            e += n // pp - k // pp - (n - k) // pp
+            pp *= p
+        if e > 0:
+            factors.append(p**e)
+    return product(factors)
+
+
+def choose_gcd(n, k):
     if k + k > n:
         k = n - k
     high = list(range(n, n - k, -1))
@@ -116,77 +223,274 @@ def combination_next1(n, c):
         ret = c[:k]
     return ret
 
-class MultiComb:
+def revolving_door_next(n, c):
+    """Step c, sorted, to the next combination in revolving door
+    (Gray code) order, in place, and return the (removed, added) pair.
+    Exactly one element leaves and one enters per step.
+    Return None, leaving c unchanged, after the last combination.
+    Start from list(range(k)). Knuth, TAOCP 7.2.1.3, Algorithm R."""
+    k = len(c)
+    if k == 0:
+        return None
+    x = c[0]
+    if k & 1:
+        if x + 1 < (c[1] if k > 1 else n):
+            c[0] = x + 1
+            return (x, x + 1)
+    elif x > 0:
+        c[0] = x - 1
+        return (x, x - 1)
+    # Alternately try to decrease c[j] (then c[j] == c[j-1] + 1)
+    # and to increase c[j] (then c[j-1] == j-1)
+    decrease = bool(k & 1)
+    j = 1
+    while j < k:
+        x = c[j]
+        if decrease:
+            if x > j:
+                c[j] = c[j - 1]
+                c[j - 1] = j - 1
+                return (x, j - 1)
+        elif x + 1 < (c[j + 1] if j + 1 < k else n):
+            c[j - 1] = x
+            c[j] = x + 1
+            return (j - 1, x + 1)
+        j += 1
+        decrease = not decrease
+    return None
+
+
+# Combinatorial number system, in combination_next (colex) order:
+# rank(c) = sum(choose(c[i], i + 1))
+
+def combination_rank(c) -> int:
+    return sum(choose(ci, i + 1) for (i, ci) in enumerate(c) if ci > i)
+
+
+def combination_unrank(r, n, k) -> List[int]:
+    if not 0 <= r < choose(n, k):
+        raise ValueError(f"rank {r} out of range for n={n}, k={k}")
+    c = k*[0]
+    x = n
+    for i in range(k - 1, -1, -1):
+        x -= 1
+        while x > i and choose(x, i + 1) > r:
+            x -= 1
+        c[i] = x
+        if x > i:
+            r -= choose(x, i + 1)
+    return c
 
-    class Level:
-        def __init__(self, k: int, lut: list):
-           self.lut = lut[:]
-           self.comb = list(range(k))
 
-        def xcomb(self) -> list:
-           ret = list(map(lambda i: self.lut[i], self.comb))
-           return ret
+def combination_slice(n, k, start, count):
+    "Yield up to count combinations, from rank start on"
+    c = combination_unrank(start, n, k) if count > 0 else None
+    while count > 0 and c is not None:
+        yield c
+        c = combination_next(n, c[:])
+        count -= 1
 
-        def n(self) -> int:
-           return len(self.lut)
 
-        def k(self) -> int:
-           return len(self.comb)
+def combination_shards(n, k, n_shards) -> List[tuple]:
+    "(start, count) of n_shards nearly equal rank slices"
+    total = choose(n, k)
+    bounds = [(total * si) // n_shards for si in range(n_shards + 1)]
+    return [(bounds[si], bounds[si + 1] - bounds[si])
+            for si in range(n_shards)]
 
-        def end(self) -> bool:
-            ret = (len(self.comb) == 0) or (self.comb[0] == self.n() - self.k())
-            return ret
 
-        def next(self) -> None:
-            self.comb = combination_next(self.n(), self.comb)
+# Permutations of range(n) in lexicographic order, ranked by Lehmer code:
+# rank(p) = sum(d[i] * factorial(n - 1 - i)),
+# d[i] = number of p[i + 1:] less than p[i]
 
-        def lut_used(self) -> List[int]:
-            return map(lambda i: self.lut[i], self.comb)
+def permutation_rank(p) -> int:
+    n = len(p)
+    unused = sorted(p)
+    r = 0
+    for (i, x) in enumerate(p):
+        j = bisect.bisect_left(unused, x)
+        r += j * factorial(n - 1 - i)
+        del unused[j]
+    return r
+
+
+def permutation_unrank(r, n) -> List[int]:
+    if not 0 <= r < factorial(n):
+        raise ValueError(f"rank {r} out of range for n={n}")
+    unused = list(range(n))
+    p = []
+    for i in range(n - 1, -1, -1):
+        (d, r) = divmod(r, factorial(i))
+        p.append(unused.pop(d))
+    return p
+
+
+def permutation_slice(n, start, count):
+    """Yield up to count permutations of range(n), as tuples,
+    from rank start on.
+    Ranks come in blocks of factorial(m) sharing their first n - m
+    elements, and each block's sorted tail is permuted by itertools.
+    m is the largest with at most count ranks skipped in the first block,
+    so a whole enumeration is a single block."""
+    m = n
+    while m > 1 and start % factorial(m) > count:
+        m -= 1
+    block = factorial(m)
+    r = start
+    end = min(start + count, factorial(n))
+    while r < end:
+        b0 = r - r % block
+        p = permutation_unrank(b0, n)
+        head = tuple(p[:n - m])
+        hi = min(end - b0, block)
+        tails = itertools.islice(itertools.permutations(p[n - m:]),
+                                 r - b0, hi)
+        if head:
+            yield from map(head.__add__, tails)
+        else:
+            yield from tails
+        r = b0 + hi
+
+
+def combination_chunks(n, k, chunk=65536):
+    """Yield all k-combinations of range(n), in combination_next order,
+    as 2-D numpy arrays of up to chunk rows.
+    Rows are unranked together: in that (colex) order the rank of c is
+    sum(choose(c[i], i + 1)), so c[i] is found by a binary search of a
+    choose(x, i + 1) column, from i = k-1 down."""
+    if np is None:
+        raise RuntimeError("combination_chunks requires numpy")
+    total = choose(n, k)
+    if total >= 2**63:
+        raise ValueError(f"choose({n}, {k}) exceeds int64")
+    return _combination_chunks(n, k, chunk, total)
+
+
+def _combination_chunks(n, k, chunk, total):
+    if k > n:
+        return
+    dtype = np.min_scalar_type(max(n - 1, 0))
+    # Clamped to total: middle columns may exceed int64 even when total
+    # does not, and searchsorted of r < total never picks a larger entry
+    tables = [np.array([(min(choose(x, i + 1), total) if x > i else 0)
+                        for x in range(n)], dtype=np.int64)
+              for i in range(k)]
+    for r0 in range(0, total, chunk):
+        r = np.arange(r0, min(r0 + chunk, total), dtype=np.int64)
+        rows = np.empty((len(r), k), dtype=dtype)
+        for i in range(k - 1, -1, -1):
+            ci = np.searchsorted(tables[i], r, side='right') - 1
+            rows[:, i] = ci
+            r -= tables[i][ci]
+        yield rows
+
+
+class MultiComb:
+    """Successive combinations of ks[0], ks[1], ... elements of range(n),
+    each level choosing from what the levels above left unused.
+    The state lives in preallocated flat arrays, level i at offsets[i]:
+      comb:  combination_next indices into the level's lut
+      xcomb: the chosen elements
+    and at lut_offsets[i], of lut_sizes[i] entries:
+      lut:   sorted elements unused by the levels above."""
 
-        def lut_unused(self) -> List[int]:
-            delta_set = set(self.lut) - set(self.lut_used())
-            delta = list(delta_set)
-            delta.sort()
-            return delta
-            
     def __init__(self, n, ks):
         self.n = n
         self.ks = ks[:]
+        self.n_levels = len(self.ks)
+        self.offsets = [0]
+        for k in self.ks:
+            self.offsets.append(self.offsets[-1] + k)
+        if self.offsets[-1] > n:
+            raise ValueError(f"sum of ks={ks} exceeds n={n}")
+        self.lut_sizes = [n - self.offsets[i] for i in range(self.nk())]
+        self.lut_offsets = [0]
+        for size in self.lut_sizes:
+            self.lut_offsets.append(self.lut_offsets[-1] + size)
+        self.comb_first = array('i', [j for k in self.ks for j in range(k)])
+        self.comb = array('i', self.comb_first)
+        self.xcomb = array('i', self.comb_first)
+        self.lut = array('i', bytes(self.lut_offsets[-1] * self.comb.itemsize))
+        self.xview = memoryview(self.xcomb).toreadonly()
         self.init_levels()
         self.ended = False
 
     def nk(self):
-        return len(self.ks)
+        return self.n_levels
+
+    def count(self) -> int:
+        return multicomb_count(self.n, self.ks)
 
     def init_levels(self):
-        self.levels = []
-        lut = list(range(self.n))
-        for i in range(self.nk()):
-            level = self.__class__.Level(self.ks[i], lut)
-            self.levels.append(level)
-            lut = lut[self.ks[i]:]
-
-    def current(self) -> List[List[int]]:
+        self.lut[0:self.n] = array('i', range(self.n))
+        self.reset_levels(0)
+
+    def reset_levels(self, i0):
+        "First combinations of levels i0, ..., given the lut of level i0"
+        comb, xcomb, lut = self.comb, self.xcomb, self.lut
+        for i in range(i0, self.n_levels):
+            (b, e) = (self.offsets[i], self.offsets[i + 1])
+            (lb, le) = (self.lut_offsets[i], self.lut_offsets[i + 1])
+            k = e - b
+            if k > 0:
+                comb[b:e] = self.comb_first[b:e]
+                xcomb[b:e] = lut[lb:lb + k]
+            if i + 1 < self.n_levels:
+                lut[le:le + (le - lb) - k] = lut[lb + k:le]
+
+    def level_end(self, i) -> bool:
+        k = self.ks[i]
+        return k == 0 or self.comb[self.offsets[i]] == self.lut_sizes[i] - k
+
+    def current(self, view=False):
+        """The combinations as a list of lists,
+        or with view, all levels' elements as one read-only flat view,
+        valid until the next step."""
         ret = None
         if not self.ended:
-            ret = list(map(lambda level: level.xcomb(), self.levels))
+            if view:
+                ret = self.xview
+            else:
+                xcomb = self.xcomb
+                offsets = self.offsets
+                ret = [xcomb[offsets[i]:offsets[i + 1]].tolist()
+                       for i in range(self.n_levels)]
         return ret
 
-    def next(self) -> List[List[int]]:
-        i = self.nk() - 1
-        while (i >= 0) and self.levels[i].end():
+    def next(self, view=False):
+        i = self.n_levels - 1
+        while (i >= 0) and self.level_end(i):
             i -= 1
         if i >= 0:
-            self.levels[i].next()
-            lut_tail = self.levels[i].lut_unused()
-            for i in range(i + 1, self.nk()):
-                self.levels[i] = self.__class__.Level(self.ks[i], lut_tail)
-                lut_tail = lut_tail[self.ks[i]:]
+            self.advance_level(i)
         else:
             self.ended = True
-        ret = self.current()
+        ret = self.current(view)
         return ret
 
+    def advance_level(self, i):
+        comb, xcomb, lut = self.comb, self.xcomb, self.lut
+        (b, e) = (self.offsets[i], self.offsets[i + 1])
+        lb = self.lut_offsets[i]
+        # In place combination_next, known not to be the last:
+        # comb[b:j+1] is a run, it becomes 0, ..., j-b-1, comb[j] + 1
+        j = b
+        while j + 1 < e and comb[j] + 1 == comb[j + 1]:
+            j += 1
+        cj = comb[j] + 1
+        comb[j] = cj
+        xcomb[j] = lut[lb + cj]
+        jb = j - b
+        if jb > 0:
+            comb[b:j] = self.comb_first[b:j]
+            xcomb[b:j] = lut[lb:lb + jb]
+        if i + 1 < self.n_levels:
+            # The lut of level i+1 changes only below cj,
+            # where level i now leaves exactly jb, ..., cj - 1
+            dst = self.lut_offsets[i + 1]
+            lut[dst:dst + cj - jb] = lut[lb + jb:lb + cj]
+            self.reset_levels(i + 1)
+
       
 # Choosing a k-multiset out of n
 # is similar of choosing (n-1) separators fron n + k - 1
@@ -255,16 +559,297 @@ class MultiSet:
 
 
 
+# Counting and uniform sampling, without enumeration.
+# rng is anything with the random.Random sample and shuffle methods.
+
+def multinomial(ks) -> int:
+    "(k0 + k1 + ...)! / (k0! k1! ...)"
+    ret = 1
+    n = 0
+    for k in ks:
+        n += k
+        ret *= choose(n, k)
+    return ret
+
+
+def multicomb_count(n, ks) -> int:
+    "Number of MultiComb(n, ks) items"
+    rest = n - sum(ks)
+    return multinomial(ks + [rest]) if rest >= 0 else 0
+
+
+def multiset_count(n, k) -> int:
+    "Number of k-multisets out of n: stars and bars"
+    return choose(n + k - 1, n - 1) if n > 0 else int(k == 0)
+
+
+def combination_random(n, k, rng=random) -> List[int]:
+    "Uniform k-combination of range(n), sorted"
+    c = rng.sample(range(n), k)
+    c.sort()
+    return c
+
+
+def multiset_random(n, k, rng=random) -> List[int]:
+    "Uniform k-multiset out of n, as a multiplicity list"
+    if n == 0:
+        if k != 0:
+            raise ValueError(f"no {k}-multiset out of 0")
+        return []
+    ms = MultiSet()
+    ms.set_combination_bars(k, combination_random(n + k - 1, n - 1, rng))
+    return ms.multiplicity
+
+
+def multicomb_random(n, ks, rng=random) -> List[List[int]]:
+    "Uniform MultiComb(n, ks) item"
+    if sum(ks) > n:
+        raise ValueError(f"sum of ks={ks} exceeds n={n}")
+    perm = list(range(n))
+    rng.shuffle(perm)
+    ret = []
+    b = 0
+    for k in ks:
+        c = perm[b:b + k]
+        c.sort()
+        ret.append(c)
+        b += k
+    return ret
+
+
+# Sharded enumeration.
+# Each kind is split by a combination rank space:
+#   combinations n k:       the combinations themselves
+#   multisets n k:          the n-1 bars out of n+k-1
+#   multicombs n k0 k1 ...: the first level combinations, each followed
+#                           by all combinations of the other levels.
+#   permutations n:         the permutations themselves, by Lehmer rank
+# Shards run in a process pool, each returns only its reduced result.
+
+SHARD_REDUCERS = ("count", "filter", "min", "max")
+SHARD_KINDS = ("combinations", "multisets", "multicombs", "permutations")
+
+
+def shard_space(kind, n, ks) -> int:
+    if kind == "combinations":
+        ret = choose(n, ks[0])
+    elif kind == "multisets":
+        ret = multiset_count(n, ks[0])
+    elif kind == "multicombs":
+        ret = choose(n, ks[0])
+    elif kind == "permutations":
+        ret = factorial(n)
+    else:
+        raise ValueError(f"Bad kind: {kind}")
+    return ret
+
+
+def shard_items(kind, n, ks, start, count):
+    if kind == "combinations":
+        yield from combination_slice(n, ks[0], start, count)
+    elif kind == "multisets":
+        ms = MultiSet()
+        for bars in combination_slice(n + ks[0] - 1, n - 1, start, count):
+            ms.set_combination_bars(ks[0], bars)
+            yield ms.multiplicity
+    elif kind == "multicombs":
+        for c0 in combination_slice(n, ks[0], start, count):
+            used = set(c0)
+            lut = [i for i in range(n) if i not in used]
+            if len(ks) == 1:
+                yield [c0]
+            else:
+                multi_comb = MultiComb(len(lut), ks[1:])
+                mc = multi_comb.current()
+                while mc is not None:
+                    yield [c0] + [[lut[i] for i in c] for c in mc]
+                    mc = multi_comb.next()
+    elif kind == "permutations":
+        yield from permutation_slice(n, start, count)
+
+
+def resolve_function(f):
+    "A callable, or its 'module:function' name"
+    if isinstance(f, str):
+        (module_name, function_name) = f.split(':')
+        f = getattr(importlib.import_module(module_name), function_name)
+    return f
+
+
+def shard_reduce(job):
+    (kind, n, ks, start, count, reducer, predicate, key) = job
+    predicate = resolve_function(predicate)
+    key = resolve_function(key)
+    n_items = 0
+    ret = [] if reducer == "filter" else None
+    if reducer == "count":
+        ret = 0
+    for item in shard_items(kind, n, ks, start, count):
+        n_items += 1
+        if predicate is not None and not predicate(item):
+            continue
+        if reducer == "count":
+            ret += 1
+        elif reducer == "filter":
+            ret.append(item[:])
+        else:
+            v = key(item) if key is not None else item
+            if (ret is None or
+                    (v < ret[0] if reducer == "min" else v > ret[0])):
+                ret = (v, item[:])
+    return (ret, n_items)
+
+
+def sharded_reduce(kind, n, ks, reducer, n_procs=None, n_shards=None,
+                   predicate=None, key=None):
+    """Reduce all items of kind over a process pool.
+    reducer: count, filter (items list), min or max (of key(item)).
+    predicate and key: picklable callables or 'module:function' names.
+    Returns (result, n_items, seconds)."""
+    if reducer not in SHARD_REDUCERS:
+        raise ValueError(f"Bad reducer: {reducer}")
+    t0 = time.time()
+    n_procs = n_procs or multiprocessing.cpu_count()
+    n_shards = n_shards or 4*n_procs
+    total = shard_space(kind, n, ks)
+    bounds = [(total * si) // n_shards for si in range(n_shards + 1)]
+    jobs = [(kind, n, ks, bounds[si], bounds[si + 1] - bounds[si], reducer,
+             predicate, key)
+            for si in range(n_shards) if bounds[si] < bounds[si + 1]]
+    pool = multiprocessing.Pool(n_procs)
+    results = pool.map(shard_reduce, jobs, 1)
+    pool.close()
+    pool.join()
+    n_items = sum(r[1] for r in results)
+    if reducer == "count":
+        ret = sum(r[0] for r in results)
+    elif reducer == "filter":
+        ret = [item for r in results for item in r[0]]
+    else:
+        found = [r[0] for r in results if r[0] is not None]
+        ret = None
+        if len(found) > 0:
+            choice = min if reducer == "min" else max
+            ret = choice(found, key=(lambda vi: vi[0]))[1]
+    return (ret, n_items, time.time() - t0)
+
+
+# Binary row output: count rows of k small unsigned values,
+# little-endian uint8, or uint16 when a value may exceed 255.
+#   bin: ROWS_MAGIC, then <IIBQ: n, k, itemsize, count, then the rows
+#   npy: a NumPy .npy version 1.0 header of shape (count, k), then the rows
+# The header k is the row width. For combinations it is the combination
+# size, for permutations k = n. multisets rows are the n multiplicities,
+# so k = n there, and the multiset size is the sum of any row.
+
+OUTPUT_FORMATS = ("text", "bin", "npy")
+# Commands of the __main__ below that write bin and npy rows
+FORMAT_COMMANDS = ("combinations", "fast_combinations", "combinations_slice",
+                   "permutations_slice", "combination_chunks", "multisets")
+ROWS_MAGIC = b"COMB\x01"
+ROWS_HEADER = struct.Struct("<IIBQ")
+
+
+def npy_header(descr, shape) -> bytes:
+    d = "{'descr': '%s', 'fortran_order': False, 'shape': (%s), }" % (
+        descr, "".join(f"{x}, " for x in shape))
+    # Magic, version and length take 10 bytes, then pad to 64
+    d += " " * (63 - (10 + len(d)) % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(d)) + d.encode()
+
+
+class RowWriter:
+    "Buffer rows and write them in blocks of about block values"
+
+    def __init__(self, f, fmt, n, k, count, vmax=None, block=1 << 20):
+        self.f = f
+        self.k = k
+        self.count = count
+        self.block = block
+        vmax = n - 1 if vmax is None else vmax
+        self.buf = array('B' if vmax < 256 else 'H')
+        self.n_rows = 0
+        if fmt == "bin":
+            f.write(ROWS_MAGIC)
+            f.write(ROWS_HEADER.pack(n, k, self.buf.itemsize, count))
+        elif fmt == "npy":
+            f.write(npy_header(f"<u{self.buf.itemsize}", (count, k)))
+        else:
+            raise ValueError(f"Bad binary format: {fmt}")
+
+    def write(self, row):
+        self.buf.extend(row)
+        self.n_rows += 1
+        if len(self.buf) >= self.block:
+            self.flush()
+
+    def write_array(self, rows):
+        "Write a 2-D numpy array of rows"
+        self.flush()
+        self.f.write(rows.astype(f"<u{self.buf.itemsize}").tobytes())
+        self.n_rows += len(rows)
+
+    def flush(self):
+        if sys.byteorder == "big":
+            self.buf.byteswap()
+        self.f.write(self.buf.tobytes())
+        del self.buf[:]
+
+    def close(self):
+        self.flush()
+        self.f.flush()
+        if self.n_rows != self.count:
+            raise ValueError(f"wrote {self.n_rows} rows, header says "
+                             f"{self.count}")
+
+
+def read_rows(f):
+    "(n, k, count, flat array) from bin format"
+    if f.read(len(ROWS_MAGIC)) != ROWS_MAGIC:
+        raise ValueError("Not binary rows")
+    (n, k, itemsize, count) = ROWS_HEADER.unpack(f.read(ROWS_HEADER.size))
+    rows = array('B' if itemsize == 1 else 'H')
+    rows.frombytes(f.read(count * k * itemsize))
+    if sys.byteorder == "big":
+        rows.byteswap()
+    return (n, k, count, rows)
+
+
 if __name__ == "__main__":
 
     rc = 0
+    out_format = "text"
+    for a in sys.argv[1:]:
+        if a.startswith("--format="):
+            out_format = a.split("=", 1)[1]
+    sys.argv = [a for a in sys.argv if not a.startswith("--format=")]
     cmd = sys.argv[1]
-    if cmd == "gcd":
+    if out_format not in OUTPUT_FORMATS:
+        sys.stderr.write("%s: Bad format: %s, expected one of: %s\n" %
+                         (sys.argv[0], out_format, " ".join(OUTPUT_FORMATS)))
+        rc = 1
+    elif out_format != "text" and cmd not in FORMAT_COMMANDS:
+        sys.stderr.write("%s: --format=%s not supported by: %s, only by: %s\n"
+                         % (sys.argv[0], out_format, cmd,
+                            " ".join(FORMAT_COMMANDS)))
+        rc = 1
+    elif cmd == "gcd":
         [m, n] = map(int, sys.argv[2:4])
         sys.stdout.write(f"gcd({m}, {n}) = {gcd(m, n)}\n")
     elif cmd == "choose":
         [n, k] = map(int, sys.argv[2:4])
         sys.stdout.write("choose(%d, %d) = %d\n" % (n, k, choose(n, k)))
+    elif cmd in ("combinations", "fast_combinations") and out_format != "text":
+        [n, k] = map(int, sys.argv[2:4])
+        f_next = (combination_next if cmd == "combinations" else
+                  fast_combination_next)
+        writer = RowWriter(sys.stdout.buffer, out_format, n, k,
+                           choose(n, k))
+        c = list(range(k)) if k <= n else None
+        while not c is None:
+            writer.write(c)
+            c = f_next(n, c)
+        writer.close()
     elif cmd == "combinations":
         [n, k] = map(int, sys.argv[2:4])
         sys.stdout.write("combinations: n=%d, k=%d\n" % (n, k))
@@ -283,6 +868,67 @@ if __name__ == "__main__":
             sys.stdout.write("C[%3d] = %s\n" % (ci, c))
             c = fast_combination_next(n, c)
             ci += 1
+    elif cmd == "revolving_door":
+        [n, k] = map(int, sys.argv[2:4])
+        sys.stdout.write("combinations: n=%d, k=%d\n" % (n, k))
+        ci = 0
+        c = list(range(k))
+        step = ()
+        while step is not None:
+            sys.stdout.write("C[%3d] = %s %s\n" % (ci, c, step))
+            step = revolving_door_next(n, c)
+            ci += 1
+    elif cmd == "combinations_slice" and out_format != "text":
+        [n, k, start, count] = map(int, sys.argv[2:6])
+        count = max(0, min(count, choose(n, k) - start))
+        writer = RowWriter(sys.stdout.buffer, out_format, n, k, count)
+        for c in combination_slice(n, k, start, count):
+            writer.write(c)
+        writer.close()
+    elif cmd == "combinations_slice":
+        [n, k, start, count] = map(int, sys.argv[2:6])
+        sys.stdout.write("combinations: n=%d, k=%d, start=%d, count=%d\n" %
+                         (n, k, start, count))
+        ci = start
+        for c in combination_slice(n, k, start, count):
+            sys.stdout.write("C[%3d] = %s\n" % (ci, c))
+            ci += 1
+    elif cmd == "permutations_slice" and out_format != "text":
+        [n, start, count] = map(int, sys.argv[2:5])
+        count = max(0, min(count, factorial(n) - start))
+        writer = RowWriter(sys.stdout.buffer, out_format, n, n, count)
+        for p in permutation_slice(n, start, count):
+            writer.write(p)
+        writer.close()
+    elif cmd == "permutations_slice":
+        [n, start, count] = map(int, sys.argv[2:5])
+        sys.stdout.write("permutations: n=%d, start=%d, count=%d\n" %
+                         (n, start, count))
+        for (pi, p) in enumerate(permutation_slice(n, start, count), start):
+            sys.stdout.write("P[%3d] = %s\n" % (pi, list(p)))
+    elif cmd == "combination_shards":
+        [n, k, n_shards] = map(int, sys.argv[2:5])
+        for (si, (start, count)) in enumerate(combination_shards(n, k, n_shards)):
+            sys.stdout.write(f"shard[{si}]: start={start} count={count}\n")
+    elif cmd == "combination_chunks" and out_format != "text":
+        [n, k] = map(int, sys.argv[2:4])
+        chunk = int(sys.argv[4]) if len(sys.argv) > 4 else 65536
+        writer = RowWriter(sys.stdout.buffer, out_format, n, k, choose(n, k))
+        for rows in combination_chunks(n, k, chunk):
+            writer.write_array(rows)
+        writer.close()
+    elif cmd == "combination_chunks":
+        [n, k] = map(int, sys.argv[2:4])
+        chunk = int(sys.argv[4]) if len(sys.argv) > 4 else 65536
+        n_rows = 0
+        n_chunks = 0
+        rows = None
+        for rows in combination_chunks(n, k, chunk):
+            n_rows += len(rows)
+            n_chunks += 1
+        last = rows[-1].tolist() if rows is not None and len(rows) else None
+        sys.stdout.write(f"combination_chunks: n={n}, k={k}: "
+                         f"{n_rows} rows in {n_chunks} chunks, last={last}\n")
     elif cmd == "multicombs":
         n = int(sys.argv[2])
         ks = list(map(int, sys.argv[3:]))
@@ -290,15 +936,20 @@ if __name__ == "__main__":
         ci = 0
         mc = multi_comb.current()
         while mc is not None:
-            sys.stdout.write(f"mc[{ci}]: [")
-            sep = ""
-            for level in multi_comb.levels:
-                xcs = ", ".join(map(str, level.xcomb()))
-                sys.stdout.write(f"{sep}[{xcs}]")
-                sep = ", "
-            sys.stdout.write("]\n")
+            sys.stdout.write(f"mc[{ci}]: {mc}\n")
             mc = multi_comb.next()
             ci += 1
+    elif cmd == "multisets" and out_format != "text":
+        [n, k] = map(int, sys.argv[2:4])
+        writer = RowWriter(sys.stdout.buffer, out_format, n, n,
+                           multiset_count(n, k), vmax=k)
+        ms = MultiSet()
+        c = list(range(n - 1))
+        while not c is None:
+            ms.set_combination_bars(k, c)
+            writer.write(ms.multiplicity)
+            c = combination_next(n + k - 1, c)
+        writer.close()
     elif cmd == "multisets":
         [n, k] = map(int, sys.argv[2:4])
         sys.stdout.write("multisets: n=%d, k=%d\n" % (n, k))
@@ -311,6 +962,63 @@ if __name__ == "__main__":
             sys.stdout.write("C[%3d] = %s\n" % (ci, ms))
             c = combination_next(n + k - 1, c)
             ci += 1
+    elif cmd == "sharded":
+        # sharded kind reducer n_procs n k... [pred=module:f] [key=module:f]
+        [kind, reducer] = sys.argv[2:4]
+        n_procs = int(sys.argv[4])
+        nums = [a for a in sys.argv[5:] if '=' not in a]
+        opts = dict(a.split('=', 1) for a in sys.argv[5:] if '=' in a)
+        [n, *ks] = map(int, nums)
+        if kind not in SHARD_KINDS:
+            sys.stderr.write("%s: Bad kind: %s\n" % (sys.argv[0], kind))
+            rc = 1
+        elif reducer not in SHARD_REDUCERS:
+            sys.stderr.write("%s: Bad reducer: %s\n" % (sys.argv[0], reducer))
+            rc = 1
+        else:
+            (ret, n_items, dt) = sharded_reduce(
+                kind, n, ks, reducer, n_procs,
+                predicate=opts.get("pred"), key=opts.get("key"))
+            if reducer == "filter":
+                for (fi, item) in enumerate(ret):
+                    sys.stdout.write("F[%3d] = %s\n" % (fi, item))
+                ret = len(ret)
+            sys.stdout.write(f"{kind} {reducer}: {ret}\n")
+            sys.stdout.write("%d items in %.3fs: %.0f items/sec\n" %
+                             (n_items, dt, n_items / max(dt, 1e-9)))
+    elif cmd == "count":
+        # count kind n k...
+        kind = sys.argv[2]
+        [n, *ks] = map(int, sys.argv[3:])
+        if kind == "combinations":
+            ret = choose(n, ks[0])
+        elif kind == "multisets":
+            ret = multiset_count(n, ks[0])
+        elif kind == "multicombs":
+            ret = multicomb_count(n, ks)
+        else:
+            ret = None
+        if ret is None:
+            sys.stderr.write("%s: Bad kind: %s\n" % (sys.argv[0], kind))
+            rc = 1
+        else:
+            sys.stdout.write(f"{kind} count: {ret}\n")
+    elif cmd == "random":
+        # random kind n_samples n k...
+        kind = sys.argv[2]
+        [n_samples, n, *ks] = map(int, sys.argv[3:])
+        if kind == "combinations":
+            sampler = lambda: combination_random(n, ks[0])
+        elif kind == "multisets":
+            sampler = lambda: multiset_random(n, ks[0])
+        elif kind == "multicombs":
+            sampler = lambda: multicomb_random(n, ks)
+        else:
+            sys.stderr.write("%s: Bad kind: %s\n" % (sys.argv[0], kind))
+            rc = 1
+            n_samples = 0
+        for si in range(n_samples):
+            sys.stdout.write("R[%3d] = %s\n" % (si, sampler()))
     elif cmd == "multiset201":
         ms = MultiSet()
         ms.set_multiplicity([2, 0, 1])
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+#
+# Benchmark comb.py enumerators and arithmetic helpers
+
+import argparse
+import collections
+import functools
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import comb
+
+ow = sys.stdout.write
+
+BENCHES = ("choose", "multicomb", "permutations", "suite")
+
+
+class LegacyMultiComb:
+    # The Level objects MultiComb used before its flat arrays
+
+    class Level:
+        def __init__(self, k, lut):
+            self.lut = lut[:]
+            self.comb = list(range(k))
+
+        def xcomb(self):
+            return list(map(lambda i: self.lut[i], self.comb))
+
+        def end(self):
+            return ((len(self.comb) == 0) or
+                    (self.comb[0] == len(self.lut) - len(self.comb)))
+
+        def next(self):
+            self.comb = comb.combination_next(len(self.lut), self.comb)
+
+        def lut_unused(self):
+            delta = list(set(self.lut) - set(self.lut[i] for i in self.comb))
+            delta.sort()
+            return delta
+
+    def __init__(self, n, ks):
+        self.ks = ks[:]
+        self.levels = []
+        lut = list(range(n))
+        for k in self.ks:
+            self.levels.append(self.Level(k, lut))
+            lut = lut[k:]
+        self.ended = False
+
+    def current(self):
+        ret = None
+        if not self.ended:
+            ret = [level.xcomb() for level in self.levels]
+        return ret
+
+    def next(self):
+        i = len(self.ks) - 1
+        while (i >= 0) and self.levels[i].end():
+            i -= 1
+        if i >= 0:
+            self.levels[i].next()
+            lut_tail = self.levels[i].lut_unused()
+            for i in range(i + 1, len(self.ks)):
+                self.levels[i] = self.Level(self.ks[i], lut_tail)
+                lut_tail = lut_tail[self.ks[i]:]
+        else:
+            self.ended = True
+        return self.current()
+
+
+def best_of(f, repeat):
+    best = None
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def choose_grid(choose_f, max_n):
+    for n in range(max_n + 1):
+        for k in range(n + 1):
+            choose_f(n, k)
+
+
+def compare(title, f_new, f_old, repeat):
+    t_new = best_of(f_new, repeat)
+    t_old = best_of(f_old, repeat)
+    ow("%-32s new %9.5fs  old %9.5fs  speedup %7.1fx\n" %
+       (title, t_new, t_old, t_old / max(t_new, 1e-12)))
+
+
+def bench_choose_factorial(args):
+    n = args.small_n
+    comb.choose(n, 0)  # grow the Pascal table
+    compare(f"choose all k, n<={n}",
+            lambda: choose_grid(comb.choose, n),
+            lambda: choose_grid(comb.choose_gcd, n), args.repeat)
+    for n in args.large_n:
+        compare(f"choose({n}, {n // 2})",
+                lambda: comb.choose(n, n // 2),
+                lambda: comb.choose_gcd(n, n // 2), args.repeat)
+    for n in args.factorial_n:
+        compare(f"factorial({n})",
+                lambda: comb.factorial(n),
+                lambda: comb.factorial_simple(n), args.repeat)
+
+
+def multicomb_steps(multi_comb, steps, **kwargs):
+    mc = multi_comb.current(**kwargs)
+    n_items = 0
+    while mc is not None and n_items < steps:
+        n_items += 1
+        mc = multi_comb.next(**kwargs)
+    return n_items
+
+
+def bench_multicomb(args):
+    n = args.multicomb[0]
+    ks = args.multicomb[1:]
+    ow(f"MultiComb n={n} ks={ks}, up to {args.steps} partitions\n")
+    for (name, cls, kwargs) in (
+            ("legacy", LegacyMultiComb, {}),
+            ("lists", comb.MultiComb, {}),
+            ("view", comb.MultiComb, {"view": True})):
+        best = None
+        for r in range(args.repeat):
+            multi_comb = cls(n, ks)
+            t0 = time.perf_counter()
+            n_items = multicomb_steps(multi_comb, args.steps, **kwargs)
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        ow("%-8s %8.3fs  %10.0f partitions/sec\n" %
+           (name, best, n_items / max(best, 1e-12)))
+
+
+def permutations_old(n):
+    a = list(range(n))
+    n_items = 0
+    while a is not None:
+        n_items += 1
+        a = comb.next_permutation(a)
+    return n_items
+
+
+def permutations_inplace(n):
+    a = list(range(n))
+    n_items = 1
+    while comb.next_permutation_inplace(a):
+        n_items += 1
+    return n_items
+
+
+def permutations_slice(n):
+    n_items = 0
+    for p in comb.permutation_slice(n, 0, comb.factorial(n)):
+        n_items += 1
+    return n_items
+
+
+def permutations_drain(n):
+    # The engine alone, drained without a Python loop
+    total = comb.factorial(n)
+    collections.deque(comb.permutation_slice(n, 0, total), maxlen=0)
+    return total
+
+
+def bench_permutations(args):
+    n = args.permutations
+    ow(f"permutations n={n}\n")
+    times = {}
+    for (name, f) in (
+            ("old", permutations_old),
+            ("inplace", permutations_inplace),
+            ("slice", permutations_slice),
+            ("drain", permutations_drain)):
+        best = None
+        for r in range(args.repeat):
+            t0 = time.perf_counter()
+            n_items = f(n)
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        times[name] = best
+        ow("%-8s %8.3fs  %10.0f permutations/sec  speedup %5.1fx\n" %
+           (name, best, n_items / max(best, 1e-12), times["old"] / best))
+
+
+# The suite: every case is (name, params, make, scale), make() returning a
+# step callable that produces one item, or None or False at the end.
+# Each case runs items // scale steps.
+
+def enumerator_step(f_next, *args):
+    "Step f_next(*args), replacing the last argument by its result"
+    state = list(args)
+
+    def step():
+        state[-1] = f_next(*state)
+        return state[-1]
+    return step
+
+
+def inplace_step(f_next, *args):
+    "Step f_next(*args), updating the last argument in place"
+    return lambda: f_next(*args) and args[-1]
+
+
+def cycle_step(f, args_list):
+    it = itertools.cycle(args_list)
+    return lambda: f(*next(it))
+
+
+def bars_step(n, k):
+    bars = []
+    c = list(range(n - 1))
+    while c is not None and len(bars) < 4096:
+        bars.append((k, c))
+        c = comb.combination_next(n + k - 1, c)
+    ms = comb.MultiSet()
+    it = itertools.cycle(bars)
+
+    def step():
+        ms.set_combination_bars(*next(it))
+        return ms.multiplicity
+    return step
+
+
+def suite_cases():
+    rng = random.Random(0)
+    cases = []
+    for (n, k) in ((100, 3), (30, 8), (40, 20)):
+        for f in (comb.combination_next, comb.fast_combination_next,
+                  comb.combination_next1):
+            cases.append((f.__name__, {"n": n, "k": k},
+                          lambda f=f, n=n, k=k:
+                          enumerator_step(f, n, list(range(k))), 1))
+        cases.append(("revolving_door_next", {"n": n, "k": k},
+                      lambda n=n, k=k: inplace_step(
+                          comb.revolving_door_next, n, list(range(k))), 1))
+    for n in (9, 12):
+        cases.append(("next_permutation", {"n": n},
+                      lambda n=n: enumerator_step(comb.next_permutation,
+                                                  list(range(n))), 1))
+        cases.append(("next_permutation_inplace", {"n": n},
+                      lambda n=n: inplace_step(comb.next_permutation_inplace,
+                                               list(range(n))), 1))
+        cases.append(("permutation_slice", {"n": n},
+                      lambda n=n: functools.partial(
+                          next, comb.permutation_slice(
+                              n, 0, comb.factorial(n)), None), 1))
+    for ks in ([3, 3, 3, 3], [4, 4, 4, 4]):
+        n = sum(ks)
+        for view in (False, True):
+            cases.append(("MultiComb.next", {"n": n, "ks": ks, "view": view},
+                          lambda n=n, ks=ks, view=view: functools.partial(
+                              comb.MultiComb(n, ks).next, view), 1))
+    for (n, k) in ((5, 10), (20, 20)):
+        cases.append(("MultiSet.set_combination_bars", {"n": n, "k": k},
+                      lambda n=n, k=k: bars_step(n, k), 1))
+    small = [(n, k) for n in range(61) for k in range(n + 1)]
+    cases.append(("choose", {"n": "0..60", "k": "0..n"},
+                  lambda: cycle_step(comb.choose, small), 1))
+    for n in (1000, 20000):
+        cases.append(("choose", {"n": n, "k": n // 2},
+                      lambda n=n: cycle_step(comb.choose, [(n, n // 2)]),
+                      n // 10))
+    for bits in (32, 256):
+        pairs = [(rng.getrandbits(bits) + 1, rng.getrandbits(bits) + 1)
+                 for i in range(4096)]
+        for f in (comb.gcd, comb.lcm):
+            cases.append((f.__name__, {"bits": bits},
+                          lambda f=f, pairs=pairs: cycle_step(f, pairs), 1))
+    for n in (20, 1000, 20000):
+        cases.append(("factorial", {"n": n},
+                      lambda n=n: cycle_step(comb.factorial, [(n,)]),
+                      max(1, n // 20)))
+    return cases
+
+
+def run_steps(step, n_items):
+    for i in range(n_items):
+        r = step()
+        if r is None or r is False:
+            return i
+    return n_items
+
+
+def traced_allocs(step, n_items):
+    """(blocks, bytes) per item still allocated while the caller holds
+    the items: what escapes a step, not temporaries freed inside it"""
+    held = n_items * [None]
+    tracemalloc.start()
+    snap0 = tracemalloc.take_snapshot()
+    n_done = n_items
+    for i in range(n_items):
+        held[i] = r = step()
+        if r is None or r is False:
+            n_done = i
+            break
+    snap1 = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = snap1.filter_traces(filters).compare_to(
+        snap0.filter_traces(filters), "filename")
+    n_done = max(n_done, 1)
+    return (sum(st.count_diff for st in stats) / n_done,
+            sum(st.size_diff for st in stats) / n_done)
+
+
+def bench_suite(args):
+    results = []
+    # Keep stdout for the JSON report
+    out = sys.stderr.write if args.json == "-" else ow
+    for (name, params, make, scale) in suite_cases():
+        n_items = max(1, args.items // scale)
+        best = None
+        for r in range(args.repeat):
+            step = make()
+            t0 = time.perf_counter()
+            n_done = run_steps(step, n_items)
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        (blocks, size) = traced_allocs(make(), min(n_items, args.traced))
+        result = {"name": name, "params": params, "items": n_done,
+                  "secs": best, "items_per_sec": n_done / max(best, 1e-12),
+                  "allocs_per_item": blocks, "bytes_per_item": size}
+        results.append(result)
+        out("%-30s %-36s %12.0f items/sec %6.2f allocs/item\n" %
+           (name, json.dumps(params), result["items_per_sec"], blocks))
+    if args.json is not None:
+        report = {"python": platform.python_version(),
+                  "items": args.items, "results": results}
+        f = sys.stdout if args.json == "-" else open(args.json, "w")
+        json.dump(report, f, indent=1)
+        f.write("\n")
+        if f is not sys.stdout:
+            f.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        "combbench", "Benchmark comb.py",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-b", "--bench", nargs="*", choices=BENCHES,
+                        default=BENCHES, help="Benchmarks to run")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Best of repeated runs")
+    parser.add_argument("--small-n", type=int, default=60,
+                        help="choose(n, k) for all k and n up to this")
+    parser.add_argument("--large-n", type=int, nargs="*",
+                        default=[2000, 20000], help="choose(n, n/2)")
+    parser.add_argument("--factorial-n", type=int, nargs="*",
+                        default=[5000, 50000], help="factorial(n)")
+    parser.add_argument("--multicomb", type=int, nargs="+",
+                        default=[16, 4, 4, 4, 4], help="MultiComb n k0 k1 ...")
+    parser.add_argument("--steps", type=int, default=200000,
+                        help="MultiComb partitions per run")
+    parser.add_argument("--permutations", type=int, default=9,
+                        help="Permutations of range(n)")
+    parser.add_argument("--items", type=int, default=100000,
+                        help="Suite steps per case, divided by its cost scale")
+    parser.add_argument("--traced", type=int, default=10000,
+                        help="Suite steps traced for allocations")
+    parser.add_argument("--json", help="Write suite results to file, - for stdout")
+    args = parser.parse_args(argv[1:])
+    if "choose" in args.bench:
+        bench_choose_factorial(args)
+    if "multicomb" in args.bench:
+        bench_multicomb(args)
+    if "permutations" in args.bench:
+        bench_permutations(args)
+    if "suite" in args.bench:
+        bench_suite(args)
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main(sys.argv)
+    sys.exit(rc)
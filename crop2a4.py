@@ -12,24 +12,374 @@ ow = sys.stdout.write
 
 def safe_unlink(fn: str):
     try:
-        os.unlike(fn)
+        os.unlink(fn)
     except:
         pass
 
 
+def parse_pages(s: str, n_pages: int) -> list:
+    """Page numbers of comma separated numbers and ranges, e.g: 1,4-6,
+    each in [1, n_pages]"""
+    pages = []
+    for r in s.split(','):
+        ss = r.split('-')
+        if len(ss) == 1:
+            (lo, hi) = (int(ss[0]), int(ss[0]))
+        elif len(ss) == 2:
+            (lo, hi) = (int(ss[0]), int(ss[1]))
+        else:
+            raise ValueError(f"Bad page range: {r}")
+        if lo > hi:
+            raise ValueError(f"Reversed page range: {r}")
+        check_page(lo, n_pages)
+        check_page(hi, n_pages)
+        pages += list(range(lo, hi + 1))
+    return pages
+
+
+def check_page(page_num: int, n_pages: int):
+    if not 1 <= page_num <= n_pages:
+        raise ValueError(f"Page {page_num} not in 1-{n_pages}")
+
+
+def read_crop_spec(fn: str, margin_default: float, n_pages: int) -> list:
+    "Lines of: pages xl yb xr yt [margin]"
+    crops = []
+    f = open(fn)
+    for (ln, line) in enumerate(f, 1):
+        ss = line.split('#')[0].split()
+        if len(ss) == 0:
+            continue
+        if len(ss) not in (5, 6):
+            f.close()
+            raise ValueError(f"{fn}:{ln}: expected: pages xl yb xr yt [margin]")
+        try:
+            rect = list(map(float, ss[1:5]))
+            margin = float(ss[5]) if len(ss) == 6 else margin_default
+            pages = parse_pages(ss[0], n_pages)
+        except ValueError as e:
+            f.close()
+            raise ValueError(f"{fn}:{ln}: {e}")
+        for page_num in pages:
+            crops.append((page_num, rect, margin))
+    f.close()
+    return crops
+
+
 def ff_crop(fn_in, fn_out, page_num, crop_rect, margin):
-    # Define crop rectangle and target A4 size in points
-    a4_width, a4_height = tuple(pypdf.PaperSize.A4)
-    media_width = a4_width - margin
-    media_height = a4_height - margin
+    ff_crops(fn_in, fn_out, [(page_num, crop_rect, margin)])
+
+
+def ff_crops(fn_in, fn_out, crops):
+    # Input parsed once, source pages shared by their crops, one output
+    reader = pypdf.PdfReader(fn_in)
+    write_crops(reader, fn_out, crops)
+
 
+def ff_spec_crops(fn_in, fn_out, fn_spec, margin):
     reader = pypdf.PdfReader(fn_in)
-    ow(f"page_num={page_num}, page_num-1={page_num - 1}, "
-       f"crop_rect={crop_rect}\n")
-    page = reader.pages[page_num - 1]  # (0-indexed)
+    crops = read_crop_spec(fn_spec, margin, len(reader.pages))
+    write_crops(reader, fn_out, crops)
 
-    # Create a new writer
+
+def ff_auto_crops(fn_in, fn_out, pages, margin, dpi, threshold):
+    reader = pypdf.PdfReader(fn_in)
+    if pages == "all":
+        pages = f"1-{len(reader.pages)}"
+    crops = []
+    for page_num in parse_pages(pages, len(reader.pages)):
+        page = reader.pages[page_num - 1]
+        if page.rotation % 360 != 0:
+            # Upright content and mediabox, as displayed
+            page.transfer_rotation_to_content()
+        media = [float(v) for v in page.mediabox]
+        rect = ink_bbox(page, dpi, threshold)
+        if rect is None:
+            rect = media  # blank page
+        else:
+            rect = [max(rect[0], media[0]), max(rect[1], media[1]),
+                    min(rect[2], media[2]), min(rect[3], media[3])]
+            if rect[0] >= rect[2] or rect[1] >= rect[3]:
+                rect = media  # all ink outside the page
+        crops.append((page_num, rect, margin))
+    write_crops(reader, fn_out, crops)
+
+
+def write_crops(reader, fn_out, crops):
+    for (page_num, crop_rect, margin) in crops:
+        check_page(page_num, len(reader.pages))
     writer = pypdf.PdfWriter()
+    for (page_num, crop_rect, margin) in crops:
+        ow(f"page_num={page_num}, page_num-1={page_num - 1}, "
+           f"crop_rect={crop_rect}\n")
+        page = reader.pages[page_num - 1]  # (0-indexed)
+        crop_page(writer, page, crop_rect, margin)
+    safe_unlink(fn_out)
+    f = open(fn_out, "wb")
+    writer.write(f)
+    f.close()
+
+
+IDENTITY = (1., 0., 0., 1., 0., 0.)
+
+def mat_mult(m1, m2):
+    "m1 then m2, PDF matrices as (a, b, c, d, e, f)"
+    (a1, b1, c1, d1, e1, f1) = m1
+    (a2, b2, c2, d2, e2, f2) = m2
+    return (a1*a2 + b1*c2, a1*b2 + b1*d2,
+            c1*a2 + d1*c2, c1*b2 + d1*d2,
+            e1*a2 + f1*c2 + e2, e1*b2 + f1*d2 + f2)
+
+
+class FontWidths:
+    """Glyph advances of a font resource, in text space units per 1 of
+    font size: /FirstChar /Widths of simple fonts, /W /DW of composite
+    (Type0, 2-byte codes) fonts. Codes without a width, and fonts without
+    tables (older standard 14 font resources), get a conservative 1 em."""
+
+    UNKNOWN = 1.
+
+    def __init__(self, font):
+        self.widths = {}
+        self.code_bytes = 1
+        self.default = self.UNKNOWN
+        (self.descent, self.ascent) = (-0.25, 1.)
+        if font is None:
+            return
+        font = font.get_object()
+        scale = 0.001
+        if font.get("/Subtype") == "/Type3":
+            scale = float(font.get("/FontMatrix", [0.001])[0])
+        if font.get("/Subtype") == "/Type0":
+            self.code_bytes = 2
+            font = font["/DescendantFonts"][0].get_object()
+            self.default = float(font.get("/DW", 1000)) * scale
+            self.read_w(font.get("/W", []), scale)
+        else:
+            first = int(font.get("/FirstChar", 0))
+            widths = font.get("/Widths")
+            if widths is not None:
+                for (i, w) in enumerate(widths.get_object()):
+                    self.widths[first + i] = float(w) * scale
+        descriptor = font.get("/FontDescriptor")
+        if descriptor is not None:
+            descriptor = descriptor.get_object()
+            missing = descriptor.get("/MissingWidth")
+            if missing is not None and len(self.widths) > 0:
+                self.default = max(self.default, float(missing) * scale)
+            # Never tighter than the metrics-free guess
+            self.descent = min(self.descent,
+                               float(descriptor.get("/Descent", 0)) * scale)
+            self.ascent = max(self.ascent,
+                              float(descriptor.get("/Ascent", 0)) * scale)
+
+    def read_w(self, w, scale):
+        # [c [w1 w2 ...]  c_first c_last w ...]
+        w = [v.get_object() for v in w.get_object()]
+        i = 0
+        while i + 1 < len(w):
+            if isinstance(w[i + 1], list):
+                for (j, wj) in enumerate(w[i + 1]):
+                    self.widths[int(w[i]) + j] = float(wj) * scale
+                i += 2
+            else:
+                for c in range(int(w[i]), int(w[i + 1]) + 1):
+                    self.widths[c] = float(w[i + 2]) * scale
+                i += 3
+
+    def advance(self, data: bytes, size, char_spacing, word_spacing) -> float:
+        "Unscaled horizontal displacement of shown string data"
+        tx = 0.
+        nb = self.code_bytes
+        for i in range(0, len(data) - nb + 1, nb):
+            code = int.from_bytes(data[i:i + nb], "big")
+            tx += self.widths.get(code, self.default) * size + char_spacing
+            if nb == 1 and code == 32:
+                tx += word_spacing
+        return tx
+
+
+class InkBBox:
+    """Bounding box of painted paths, text and images of a page content
+    stream, in default user space. Text extent follows the fonts' width
+    tables and the text state (Tc, Tw, Tz, Ts, TJ adjustments). With
+    dpi > 0, images are reduced to that resolution and only their ink
+    pixels count (scanned pages)."""
+
+    PAINT_OPS = {b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*"}
+    SHOW_OPS = {b"Tj", b"TJ", b"'", b'"'}
+
+    def __init__(self, dpi=0, threshold=128):
+        self.dpi = dpi
+        self.threshold = threshold
+        self.xs = []
+        self.ys = []
+        self.fonts = {}
+
+    def bbox(self):
+        ret = None
+        if len(self.xs) > 0:
+            ret = [min(self.xs), min(self.ys), max(self.xs), max(self.ys)]
+        return ret
+
+    def add(self, ctm, points):
+        (a, b, c, d, e, f) = ctm
+        for (x, y) in points:
+            self.xs.append(a*x + c*y + e)
+            self.ys.append(b*x + d*y + f)
+
+    def walk(self, content, resources, ctm):
+        gs_stack = []
+        path = []
+        (tm, tlm) = (IDENTITY, IDENTITY)
+        # Text state: font, size, leading, Tc, Tw, Tz / 100, Ts
+        ts = (FontWidths(None), 0., 0., 0., 0., 1., 0.)
+        for (operands, op) in content.operations:
+            if op == b"q":
+                gs_stack.append((ctm, ts))
+            elif op == b"Q":
+                if gs_stack:
+                    (ctm, ts) = gs_stack.pop()
+            elif op == b"cm":
+                ctm = mat_mult(tuple(map(float, operands)), ctm)
+            elif op in (b"m", b"l"):
+                path.append(tuple(map(float, operands)))
+            elif op in (b"c", b"v", b"y"):
+                v = list(map(float, operands))
+                path += list(zip(v[0::2], v[1::2]))
+            elif op == b"re":
+                (x, y, w, h) = map(float, operands)
+                path += [(x, y), (x + w, y + h)]
+            elif op in self.PAINT_OPS:
+                self.add(ctm, path)
+                path = []
+            elif op == b"n":
+                path = []  # clipping only
+            elif op == b"BT":
+                tm = tlm = IDENTITY
+            elif op == b"Tf":
+                ts = (self.font(resources, operands[0]), float(operands[1])
+                      ) + ts[2:]
+            elif op in self.TEXT_STATE_OPS:
+                i = self.TEXT_STATE_OPS[op]
+                v = float(operands[0]) / (100. if op == b"Tz" else 1.)
+                ts = ts[:i] + (v,) + ts[i + 1:]
+            elif op in (b"Td", b"TD"):
+                (tx, ty) = map(float, operands)
+                if op == b"TD":
+                    ts = ts[:2] + (-ty,) + ts[3:]
+                tm = tlm = mat_mult((1., 0., 0., 1., tx, ty), tlm)
+            elif op == b"Tm":
+                tm = tlm = tuple(map(float, operands))
+            elif op == b"T*":
+                tm = tlm = mat_mult((1., 0., 0., 1., 0., -ts[2]), tlm)
+            elif op in self.SHOW_OPS:
+                if op == b'"':
+                    ts = ts[:3] + (float(operands[1]), float(operands[0])
+                                   ) + ts[5:]
+                if op in (b"'", b'"'):
+                    tm = tlm = mat_mult((1., 0., 0., 1., 0., -ts[2]), tlm)
+                tx = self.show(mat_mult(tm, ctm), ts, operands[-1])
+                tm = mat_mult((1., 0., 0., 1., tx, 0.), tm)
+            elif op == b"Do":
+                self.draw_xobject(resources, operands[0], ctm)
+
+    # Text state tuple index, of operators with a single operand
+    TEXT_STATE_OPS = {b"TL": 2, b"Tc": 3, b"Tw": 4, b"Tz": 5, b"Ts": 6}
+
+    def font(self, resources, name) -> FontWidths:
+        fonts = resources.get("/Font") if resources else None
+        font = None
+        if fonts is not None and name in fonts.get_object():
+            font = fonts.get_object()[name].get_object()
+        ret = self.fonts.get(id(font))
+        if ret is None:
+            ret = self.fonts[id(font)] = FontWidths(font)
+        return ret
+
+    def show(self, trm, ts, operand) -> float:
+        # Bound the glyph boxes of a Tj string or TJ array, return the
+        # horizontal text space displacement
+        (font, size, leading, tc, tw, th, rise) = ts
+        x = x_min = x_max = 0.
+        for item in (operand if isinstance(operand, list) else [operand]):
+            if isinstance(item, (str, bytes)):
+                data = (item if isinstance(item, bytes) else
+                        item.get_original_bytes())
+                x += font.advance(data, size, tc, tw) * th
+            else:
+                x -= float(item) / 1000. * size * th
+            x_min = min(x_min, x)
+            x_max = max(x_max, x)
+        (y_min, y_max) = (rise + font.descent*size, rise + font.ascent*size)
+        self.add(trm, [(x_min, y_min), (x_max, y_min),
+                       (x_min, y_max), (x_max, y_max)])
+        return x
+
+    def draw_xobject(self, resources, name, ctm):
+        xobjects = resources.get("/XObject") if resources else None
+        if xobjects is None or name not in xobjects.get_object():
+            return
+        xobj = xobjects.get_object()[name].get_object()
+        subtype = xobj.get("/Subtype")
+        if subtype == "/Image":
+            if self.dpi > 0:
+                self.add(ctm, self.image_ink(xobj, ctm))
+            else:
+                self.add(ctm, [(0., 0.), (1., 1.)])
+        elif subtype == "/Form":
+            matrix = tuple(map(float, xobj.get("/Matrix", IDENTITY)))
+            content = pypdf.generic.ContentStream(xobj, None)
+            form_resources = xobj.get("/Resources")
+            if form_resources is not None:
+                form_resources = form_resources.get_object()
+            self.walk(content, form_resources, mat_mult(matrix, ctm))
+
+    def image_ink(self, xobj, ctm) -> list:
+        # Unit square corners of the ink pixels, image reduced to self.dpi
+        import numpy
+        try:
+            image = xobj.decode_as_image().convert("L")
+        except Exception as e:
+            ow(f"image not decoded, bounding it whole: {e}\n")
+            return [(0., 0.), (1., 1.)]
+        (a, b, c, d, e, f) = ctm
+        w_pt = (a*a + b*b) ** 0.5
+        h_pt = (c*c + d*d) ** 0.5
+        w = max(1, min(image.width, int(w_pt * self.dpi / 72)))
+        h = max(1, min(image.height, int(h_pt * self.dpi / 72)))
+        pixels = numpy.asarray(image.reduce(
+            (max(1, image.width // w), max(1, image.height // h))))
+        ink = pixels < self.threshold
+        rows = numpy.flatnonzero(ink.any(axis=1))
+        cols = numpy.flatnonzero(ink.any(axis=0))
+        ret = []
+        if len(rows) > 0:
+            (ph, pw) = pixels.shape
+            # Image row 0 is the top of the unit square
+            ret = [(float(cols[0] / pw), float(1. - (rows[-1] + 1) / ph)),
+                   (float((cols[-1] + 1) / pw), float(1. - rows[0] / ph))]
+        return ret
+
+
+def ink_bbox(page, dpi=0, threshold=128):
+    contents = page.get_contents()
+    ret = None
+    if contents is not None:
+        ib = InkBBox(dpi, threshold)
+        resources = page.get("/Resources")
+        if resources is not None:
+            resources = resources.get_object()
+        ib.walk(contents, resources, IDENTITY)
+        ret = ib.bbox()
+    return ret
+
+
+def crop_page(writer, page, crop_rect, margin):
+    # Define crop rectangle and target A4 size in points
+    a4_width, a4_height = tuple(pypdf.PaperSize.A4)
+    media_width = a4_width - margin
+    media_height = a4_height - margin
 
     # Crop the original page
     page.cropbox = pypdf.generic.RectangleObject(crop_rect)
@@ -63,10 +413,6 @@ def ff_crop(fn_in, fn_out, page_num, crop_rect, margin):
         0, scale,
         tx, ty]
     new_page.merge_transformed_page(page2=page, ctm=ctm)
-    
-    safe_unlink(fn_out)
-    f = open(fn_out, "wb")
-    writer.write(f)
 
 
 def crop2a4(argv):
@@ -74,19 +420,53 @@ def crop2a4(argv):
     parser = argparse.ArgumentParser(
         "Crop PDF page",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "-s", "--spec",
+        help="Crop spec file, lines of: pages xl yb xr yt [margin]"
+        " where pages is like: 1,4-6. Replaces page..margin arguments")
+    parser.add_argument(
+        "-a", "--auto",
+        help="Pages (like: 1,4-6 or: all) to crop to their ink bounding"
+        " box. Replaces page..margin arguments")
+    parser.add_argument(
+        "-m", "--auto-margin",
+        type=float, default=0.,
+        help="Margin for --auto")
+    parser.add_argument(
+        "--dpi",
+        type=float, default=0.,
+        help="For --auto, if > 0, reduce images (scanned pages) to this"
+        " resolution and bound their ink pixels")
+    parser.add_argument(
+        "--threshold",
+        type=int, default=128,
+        help="For --dpi, gray level below which a pixel is ink")
     parser.add_argument("input", help="Input PDF")
     parser.add_argument("output", help="Output PDF")
-    parser.add_argument("page", type=int, help="page number")
-    parser.add_argument("xl", type=float, help="X-Left")
-    parser.add_argument("yb", type=float, help="Y-Bottom")
-    parser.add_argument("xr", type=float, help="X-Right")
-    parser.add_argument("yt", type=float, help="Y-Top")
-    parser.add_argument("margin", type=float, help="margin")
+    parser.add_argument("page", type=int, nargs="?", help="page number")
+    parser.add_argument("xl", type=float, nargs="?", help="X-Left")
+    parser.add_argument("yb", type=float, nargs="?", help="Y-Bottom")
+    parser.add_argument("xr", type=float, nargs="?", help="X-Right")
+    parser.add_argument("yt", type=float, nargs="?", help="Y-Top")
+    parser.add_argument("margin", type=float, nargs="?", help="margin")
     args = parser.parse_args(argv)
     ow(f"args={args}\n")
 
-    rect = [args.xl, args.yb, args.xr, args.yt]
-    ff_crop(args.input, args.output, args.page, rect, args.margin)
+    try:
+        if args.auto is not None:
+            ff_auto_crops(args.input, args.output, args.auto,
+                          args.auto_margin, args.dpi, args.threshold)
+        elif args.spec is not None:
+            margin = 0. if args.margin is None else args.margin
+            ff_spec_crops(args.input, args.output, args.spec, margin)
+        elif args.margin is None:
+            parser.error("Missing page xl yb xr yt margin, or --spec")
+        else:
+            rect = [args.xl, args.yb, args.xr, args.yt]
+            ff_crop(args.input, args.output, args.page, rect, args.margin)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        rc = 1
     return rc
 
 
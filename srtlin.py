@@ -1,10 +1,33 @@
 #!/usr/bin/env python
 #
-# Linear adjust .srt times with video
+# Linear adjust .srt, .vtt and .ass times with video
 #
 
 import argparse
+import bisect
+import glob
+import multiprocessing
+import multiprocessing.pool
+import os
+import random
 import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BUFSIZE = 1 << 20
+FITS = ("piecewise", "lsq")
+
+# Fast path tables: digits zeroed to match a fixed-width cue line,
+# and time stamp fields as bytes
+ZERO_DIGITS = bytes.maketrans(b"123456789", b"000000000")
+PAD2 = [b"%02d" % i for i in range(100)]
+PAD3 = [b"%03d" % i for i in range(1000)]
+MMSS = [b"%02d:%02d" % divmod(i, 60) for i in range(3600)]
+MAX_FAST_MS = 100*3600*1000
 
 def vlog(msg: str) -> None:
     sys.stderr.write(f"{msg}\n")
@@ -30,6 +53,131 @@ def hhmmssms_to_ms(s):
     seconds = seconds + 60*(minutes + 60*hours)
     return 1000*seconds + ms
 
+
+# Format adapters. Each rewrites the time stamps of a text line,
+# given the ms transform, and finds cue start times.
+# fixed_cue, if not None, is the fixed-width cue line of the byte path,
+# with digits zeroed, and fixed_format its bytes format from
+# (hours, MM:SS, ms) fields.
+
+class SrtFormat:
+    "SRT: HH:MM:SS,mmm --> HH:MM:SS,mmm"
+    fixed_cue = b"00:00:00,000 --> 00:00:00,000"
+    fixed_format = b"%b:%b,%b --> %b:%b,%b"
+
+    def __init__(self, xform_ms):
+        self.xform_ms = xform_ms
+
+    def parse_time(self, t: str) -> int:
+        return hhmmssms_to_ms(t)
+
+    def format_time(self, ms: int) -> str:
+        return ms2srttime(ms)
+
+    def xform_time(self, t: str) -> str:
+        return self.format_time(self.xform_ms(self.parse_time(t)))
+
+    def xform_line(self, line: str) -> str:
+        "The rewritten line, or None"
+        ret = None
+        ss = line.split()
+        if len(ss) == 3 and ss[1] == "-->":
+            ret = f"{self.xform_time(ss[0])} --> {self.xform_time(ss[2])}\n"
+        return ret
+
+    def cue_start(self, line: str) -> int:
+        "Start ms of a cue line, or None"
+        ss = line.split()
+        return (self.parse_time(ss[0]) if len(ss) >= 3 and ss[1] == "-->"
+                else None)
+
+
+class VttFormat(SrtFormat):
+    """WebVTT: [HH:]MM:SS.mmm --> [HH:]MM:SS.mmm [settings],
+    written with hours. The WEBVTT header and blocks pass as they are."""
+    fixed_cue = b"00:00:00.000 --> 00:00:00.000"
+    fixed_format = b"%b:%b.%b --> %b:%b.%b"
+
+    def parse_time(self, t: str) -> int:
+        return hhmmssms_to_ms(t.replace('.', ','))
+
+    def format_time(self, ms: int) -> str:
+        return ms2srttime(ms).replace(',', '.')
+
+    def xform_line(self, line: str) -> str:
+        ret = None
+        ss = line.split()
+        if len(ss) >= 3 and ss[1] == "-->":
+            ret = " ".join([self.xform_time(ss[0]), "-->",
+                            self.xform_time(ss[2])] + ss[3:]) + "\n"
+        return ret
+
+
+class AssFormat(SrtFormat):
+    """ASS/SSA: H:MM:SS.cc Start and End fields of Dialogue: and Comment:
+    event lines, at their places in the [Events] Format: line"""
+    fixed_cue = None
+    events = ("Dialogue:", "Comment:")
+
+    def __init__(self, xform_ms):
+        super().__init__(xform_ms)
+        (self.start, self.end) = (1, 2)
+
+    def parse_time(self, t: str) -> int:
+        (hms, cs) = t.strip().split('.')
+        return hhmmssms_to_ms(hms) + 10*int(cs)
+
+    def format_time(self, ms: int) -> str:
+        (n, cs) = divmod((ms + 5)//10, 100)
+        (n, seconds) = divmod(n, 60)
+        (hours, minutes) = divmod(n, 60)
+        return "%d:%02d:%02d.%02d" % (hours, minutes, seconds, cs)
+
+    def event_fields(self, line: str) -> list:
+        "[kind, field, ...] of an event line, or None"
+        ret = None
+        if line.startswith("Format:"):
+            names = [name.strip() for name in line[7:].split(',')]
+            if "Start" in names and "End" in names:
+                (self.start, self.end) = (names.index("Start"),
+                                          names.index("End"))
+        elif line.startswith(self.events):
+            (kind, rest) = line.split(':', 1)
+            n_split = max(self.start, self.end) + 1
+            ret = [kind] + rest.split(',', n_split)
+            if len(ret) <= n_split:
+                ret = None
+        return ret
+
+    def xform_line(self, line: str) -> str:
+        ret = None
+        fields = self.event_fields(line)
+        if fields is not None:
+            for fi in (self.start + 1, self.end + 1):
+                t = fields[fi]
+                lead = t[:len(t) - len(t.lstrip())]
+                fields[fi] = lead + self.xform_time(t)
+            ret = fields[0] + ":" + ",".join(fields[1:])
+        return ret
+
+    def cue_start(self, line: str) -> int:
+        fields = self.event_fields(line)
+        return (self.parse_time(fields[self.start + 1])
+                if fields is not None else None)
+
+
+FORMATS = {"srt": SrtFormat, "vtt": VttFormat, "ass": AssFormat,
+           "ssa": AssFormat}
+
+
+def file_format(fn: str, fmt: str = "auto") -> str:
+    "fmt, or if auto, from the extension of fn, defaulting to srt"
+    if fmt == "auto":
+        ext = os.path.splitext(fn)[1][1:].lower()
+        fmt = ext if ext in FORMATS else "srt"
+    return fmt
+
+
 class SrtLin:
     def __init__(self,
             vidt0: str,
@@ -37,98 +185,533 @@ class SrtLin:
             vidt1: str,
             srtt1: str,
             fn_in: str,
-            fn_out: str):
+            fn_out: str,
+            quiet: bool = False,
+            anchors: list = None,
+            fit: str = "piecewise",
+            fast: bool = True,
+            fmt: str = "auto"):
         self.vidt0 = vidt0
         self.srtt0 = srtt0
         self.vidt1 = vidt1
         self.srtt1 = srtt1
+        # (vidt, srtt) pairs, default: the two above
+        self.anchors = (anchors if anchors is not None else
+                        [(vidt0, srtt0), (vidt1, srtt1)])
+        self.fit = fit
+        self.fast = fast
+        self.fmt = file_format(fn_in, fmt)
         self.fn_in = fn_in
         self.fn_out = fn_out
+        self.quiet = quiet
+        self.n_lines = 0
+        self.n_xforms = 0
+
+    def log(self, msg: str) -> None:
+        if not self.quiet:
+            vlog(msg)
 
     def run(self) -> int:
         self.compute_xfrom()
+        self.adapter = FORMATS[self.fmt](self.xform_ms)
+        rc = (self.run_bytes() if self.fast and self.adapter.fixed_cue
+              else self.run_lines())
+        self.log(f"xform/lines = {self.n_xforms}/{self.n_lines}")
+        return rc
+
+    def run_lines(self) -> int:
+        "The general path: split and parse every line"
         rc = 0
         n_lines = 0
         n_xforms = 0
-        out = open(self.fn_out, "w")
-        # for line in open(self.fn_in).readlines():
-        fin = open(self.fn_in)
-        line = "dum"
+        out = open(self.fn_out, "w", buffering=BUFSIZE)
+        fin = open(self.fn_in, buffering=BUFSIZE)
         prev_line = ""
-        ln = 0
-        while line != "":
-            ln += 1
+        while True:
+            # Whole buffered blocks of lines, cut at the last newline
             try:
-                line = fin.readline()
+                lines = fin.readlines(BUFSIZE)
             except Exception as e:
-                vlog(f"Failed to read line {ln} after {prev_line}. reason: {e}")
-                # sys.exit(1)
-                line = ""
-            prev_line = line
-            ss = line.split()
-            if len(ss) == 3 and ss[1] == "-->":
-                tb = self.xform(ss[0])
-                te = self.xform(ss[2])
-                line = f"{tb} --> {te}\n"
-                n_xforms += 1
-            out.write(line)
-            n_lines += 1
+                vlog(f"Failed to read line {n_lines + 1} after {prev_line}. "
+                     f"reason: {e}")
+                lines = []
+            if not lines:
+                break
+            for (li, line) in enumerate(lines):
+                xline = self.adapter.xform_line(line)
+                if xline is not None:
+                    lines[li] = xline
+                    n_xforms += 1
+            out.writelines(lines)
+            n_lines += len(lines)
+            prev_line = lines[-1]
+        fin.close()
+        out.close()
+        self.n_lines = n_lines
+        self.n_xforms = n_xforms
+        return rc
+
+    def run_bytes(self) -> int:
+        """The fast path: blocks of whole lines as bytearrays,
+        jumping from one '-->' to the next"""
+        rc = 0
+        n_lines = 0
+        n_xforms = 0
+        out = open(self.fn_out, "wb")
+        fin = open(self.fn_in, "rb")
+        tail = b""
+        eof = False
+        while not eof:
+            data = fin.read(BUFSIZE)
+            eof = (data == b"")
+            data = tail + data
+            cut = len(data) if eof else data.rfind(b"\n") + 1
+            (block, tail) = (data[:cut], data[cut:])
+            if not block:
+                continue
+            if b"\r" in block:
+                # As text mode universal newlines
+                block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            block = bytearray(block)
+            n_lines += block.count(b"\n") + (block[-1] != 10)
+            n_xforms += self.xform_block(block, out)
+        fin.close()
         out.close()
-        vlog(f"xform/lines = {n_xforms}/{n_lines}")
+        self.n_lines = n_lines
+        self.n_xforms = n_xforms
         return rc
 
+    def xform_block(self, block: bytearray, out) -> int:
+        """Rewrite the adapter's fixed-width cue lines in place,
+        others with '-->' by its general parser. Write the block to out.
+        Return the number of lines transformed."""
+        adapter = self.adapter
+        (fixed_cue, fixed_format) = (adapter.fixed_cue, adapter.fixed_format)
+        n_xforms = 0
+        pieces = []
+        written = 0
+        (bounds, segments) = (self.segment_bounds, self.segments)
+        a = block.find(b"-->")
+        while a >= 0:
+            b = block.rfind(b"\n", 0, a) + 1
+            e = block.find(b"\n", a)
+            if e < 0:
+                e = len(block)
+            fixed = False
+            # A last line without newline gets one, by the general path
+            if (e == b + 29 and e < len(block) and
+                    block[b:e].translate(ZERO_DIGITS) == fixed_cue):
+                # Digits of both time stamps as one number
+                (tb, te) = divmod(int(block[b:e].translate(None, b":,. ->")),
+                                  1000000000)
+                (tb, ms) = divmod(tb, 100000)
+                tb = (tb//100*60 + tb % 100)*60000 + ms
+                (te, ms) = divmod(te, 100000)
+                te = (te//100*60 + te % 100)*60000 + ms
+                (srt_ms, p, q, r, half) = segments[bisect.bisect_right(
+                    bounds, tb)]
+                tb = (p*tb + q + half) // r
+                (srt_ms, p, q, r, half) = segments[bisect.bisect_right(
+                    bounds, te)]
+                te = (p*te + q + half) // r
+                fixed = (0 <= tb < MAX_FAST_MS and 0 <= te < MAX_FAST_MS)
+            if fixed:
+                (tb, ms) = divmod(tb, 1000)
+                (hours, tb) = divmod(tb, 3600)
+                (te, ms1) = divmod(te, 1000)
+                (hours1, te) = divmod(te, 3600)
+                block[b:e] = fixed_format % (
+                    PAD2[hours], MMSS[tb], PAD3[ms],
+                    PAD2[hours1], MMSS[te], PAD3[ms1])
+                n_xforms += 1
+            else:
+                xline = adapter.xform_line(
+                    block[b:e].decode("utf-8", "replace"))
+                if xline is not None:
+                    pieces.append(block[written:b])
+                    pieces.append(xline.encode())
+                    written = min(e + 1, len(block))
+                    n_xforms += 1
+            a = block.find(b"-->", e)
+        if pieces:
+            pieces.append(block[written:])
+            out.writelines(pieces)
+        else:
+            out.write(block)
+        return n_xforms
+
     def compute_xfrom(self):
-        vidt0_ms = hhmmssms_to_ms(self.vidt0)
-        srtt0_ms = hhmmssms_to_ms(self.srtt0)
-        vidt1_ms = hhmmssms_to_ms(self.vidt1)
-        srtt1_ms = hhmmssms_to_ms(self.srtt1)
-        vlog(f"vidt0_ms={vidt0_ms} srtt0_ms={srtt0_ms} "
-             f"vidt1_ms={vidt1_ms} srtt1_ms={srtt1_ms}")
-        self.vidt0_ms = vidt0_ms
-        self.srtt0_ms = srtt0_ms
-        self.delta_vid = vidt1_ms - vidt0_ms
-        self.delta_srt = srtt1_ms - srtt0_ms
+        """Segments (srt_ms from, P, Q, R, half) mapping
+        srt ms to video (P*ms + Q + half) // R, exact in integers.
+        piecewise: lines through successive anchors, sorted by srt time,
+                   extended beyond the first and last
+        lsq:       one least-squares line through all anchors"""
+        pairs = sorted((hhmmssms_to_ms(srtt), hhmmssms_to_ms(vidt))
+                       for (vidt, srtt) in self.anchors)
+        for (si, (srt_ms, vid_ms)) in enumerate(pairs):
+            self.log(f"anchor[{si}]: vid_ms={vid_ms} srt_ms={srt_ms}")
+        if len(pairs) < 2:
+            raise ValueError("At least 2 anchors needed")
+        for ai in range(1, len(pairs)):
+            if pairs[ai - 1][0] == pairs[ai][0]:
+                raise ValueError(f"Anchors share srt time {pairs[ai][0]}ms")
+        self.segments = []
+        self.segment_bounds = []
+        if self.fit == "lsq":
+            n = len(pairs)
+            sx = sum(x for (x, y) in pairs)
+            sy = sum(y for (x, y) in pairs)
+            sxx = sum(x*x for (x, y) in pairs)
+            sxy = sum(x*y for (x, y) in pairs)
+            # slope num/den, intercept (sy - slope*sx)/n
+            num = n*sxy - sx*sy
+            den = n*sxx - sx*sx
+            self.add_segment(pairs[0][0], n*num, sy*den - num*sx, n*den)
+            self.log_residuals(pairs)
+        else:
+            for ai in range(len(pairs) - 1):
+                ((srt0, vid0), (srt1, vid1)) = pairs[ai:ai + 2]
+                delta_vid = vid1 - vid0
+                delta_srt = srt1 - srt0
+                self.add_segment(srt0, delta_vid,
+                                 vid0*delta_srt - srt0*delta_vid, delta_srt)
+
+    def add_segment(self, srt_ms, p, q, r):
+        # Segment i covers from segment_bounds[i - 1] on
+        if self.segments:
+            self.segment_bounds.append(srt_ms)
+        self.segments.append((srt_ms, p, q, r, r//2))
+
+    def log_residuals(self, pairs):
+        sq = 0
+        for (si, (srt_ms, vid_ms)) in enumerate(pairs):
+            residual = vid_ms - self.xform_ms(srt_ms)
+            sq += residual*residual
+            self.log(f"anchor[{si}]: srt={ms2srttime(srt_ms)} "
+                     f"vid={ms2srttime(vid_ms)} residual={residual}ms")
+        self.rms_residual = (sq / len(pairs))**0.5
+        self.log(f"lsq: rms residual={self.rms_residual:.1f}ms")
+
+    def xform_ms(self, ms: int) -> int:
+        si = bisect.bisect_right(self.segment_bounds, ms)
+        (srt_ms, p, q, r, half) = self.segments[si]
+        return (p*ms + q + half) // r
 
     def xform(self, t: str) -> str:
-        half = self.delta_srt//2
-        ms = hhmmssms_to_ms(t)
-        dt = ms - self.srtt0_ms
-        xms = ((dt*self.delta_vid) + half) // self.delta_srt + self.vidt0_ms
-        return ms2srttime(xms)
-        
+        return ms2srttime(self.xform_ms(hhmmssms_to_ms(t)))
+
+
+def read_anchors(fn: str) -> list:
+    "Lines of: vidt srtt"
+    anchors = []
+    f = open(fn)
+    for (ln, line) in enumerate(f, 1):
+        ss = line.split()
+        if len(ss) == 0 or ss[0].startswith('#'):
+            continue
+        if len(ss) != 2:
+            raise ValueError(f"{fn}:{ln}: expected: vidt srtt")
+        anchors.append((ss[0], ss[1]))
+    f.close()
+    return anchors
+
+
+# Anchors estimation against a correctly timed reference .srt:
+# cue onset histograms are cross-correlated by FFT, for each candidate
+# scale, giving a coarse offset. Cues then matched to their nearest
+# reference cue are fitted by RANSAC and least squares on the inliers.
+
+# Frame rate conversions, srt to video time
+SCALES = (1.0, 25/23.976, 23.976/25, 25/24, 24/25, 24/23.976, 23.976/24)
+
+
+def read_cue_starts(fn: str, fmt: str = "auto") -> list:
+    "Sorted cue start times in ms"
+    starts = []
+    adapter = FORMATS[file_format(fn, fmt)](None)
+    f = open(fn, errors="replace")
+    for line in f:
+        start = adapter.cue_start(line)
+        if start is not None:
+            starts.append(start)
+    f.close()
+    starts.sort()
+    return starts
+
+
+def fft_offset(ref, srt, scale, bin_ms):
+    "(score, offset ms) best aligning srt*scale + offset onto ref"
+    ref_bins = np.rint(ref / bin_ms).astype(np.int64)
+    srt_bins = np.rint(srt * scale / bin_ms).astype(np.int64)
+    size = 1
+    while size < ref_bins.max() + srt_bins.max() + 3:
+        size *= 2
+    h_ref = np.bincount(ref_bins, minlength=size).astype(float)
+    h_srt = np.bincount(srt_bins, minlength=size).astype(float)
+    # Tolerate jitter of a bin
+    h_ref = np.convolve(h_ref, [1.0, 1.0, 1.0], mode="same")
+    corr = np.fft.irfft(np.fft.rfft(h_ref) * np.conj(np.fft.rfft(h_srt)),
+                        size)
+    lag = int(np.argmax(corr))
+    if lag > size // 2:
+        lag -= size
+    return (float(corr.max()), lag * bin_ms)
+
+
+def ransac_line(x, y, tol_ms, n_iters, rng):
+    "(slope, intercept, inliers mask) of y ~ slope*x + intercept"
+    best = None
+    for it in range(n_iters):
+        (i, j) = rng.sample(range(len(x)), 2)
+        if x[i] == x[j]:
+            continue
+        slope = (y[j] - y[i]) / (x[j] - x[i])
+        inliers = np.abs(y - (y[i] + slope * (x - x[i]))) < tol_ms
+        if best is None or inliers.sum() > best.sum():
+            best = inliers
+    if best is None:
+        best = np.ones(len(x), dtype=bool)
+    (slope, intercept) = np.polyfit(x[best], y[best], 1)
+    return (slope, intercept, best)
+
+
+def estimate_anchors(ref_starts, srt_starts, scales=SCALES, bin_ms=100,
+                     match_ms=1500, tol_ms=200, n_iters=500, log=vlog):
+    """Two (vidt, srtt) anchors of the linear map best taking
+    srt_starts onto ref_starts"""
+    if np is None:
+        raise RuntimeError("Estimating anchors requires numpy")
+    if len(ref_starts) < 2 or len(srt_starts) < 2:
+        raise ValueError("Estimating anchors requires 2 or more cues each")
+    ref = np.array(ref_starts, dtype=float)
+    srt = np.array(srt_starts, dtype=float)
+    ((score, offset), scale) = max(
+        (fft_offset(ref, srt, scale, bin_ms), scale) for scale in scales)
+    log(f"coarse: scale={scale:.6f} offset={offset}ms score={score:.0f}")
+    # Nearest reference cue of each coarsely mapped cue
+    mapped = srt * scale + offset
+    ri = np.clip(np.searchsorted(ref, mapped), 1, len(ref) - 1)
+    ri -= (mapped - ref[ri - 1]) < (ref[ri] - mapped)
+    near = np.abs(ref[ri] - mapped) < match_ms
+    (x, y) = (srt[near], ref[ri[near]])
+    if len(x) < 2:
+        raise ValueError("No cues match the reference")
+    (slope, intercept, inliers) = ransac_line(x, y, tol_ms, n_iters,
+                                              random.Random(0))
+    residuals = y[inliers] - (slope * x[inliers] + intercept)
+    log(f"fit: scale={slope:.6f} offset={intercept:.0f}ms "
+        f"inliers={int(inliers.sum())}/{len(srt)} "
+        f"rms residual={np.sqrt(np.mean(residuals**2)):.1f}ms")
+    anchors = []
+    for srt_ms in (int(x[inliers].min()), int(x[inliers].max())):
+        vid_ms = int(round(slope * srt_ms + intercept))
+        anchors.append((ms2srttime(vid_ms), ms2srttime(srt_ms)))
+    return anchors
+
+
+# Batch mode: many (fn_in, fn_out, anchors, fit, fmt, fast) jobs
+# in a process or thread pool
+
+def read_manifest(fn: str, fit: str = "piecewise", fmt: str = "auto",
+                  fast: bool = True) -> list:
+    "Lines of: in.srt out.srt vidt0 srtt0 vidt1 srtt1 [vidt srtt ...]"
+    jobs = []
+    f = open(fn)
+    for (ln, line) in enumerate(f, 1):
+        ss = line.split()
+        if len(ss) == 0 or ss[0].startswith('#'):
+            continue
+        if len(ss) < 6 or len(ss) % 2 != 0:
+            raise ValueError(f"{fn}:{ln}: expected: in.srt out.srt "
+                             "vidt0 srtt0 vidt1 srtt1 [vidt srtt ...]")
+        anchors = list(zip(ss[2::2], ss[3::2]))
+        jobs.append((ss[0], ss[1], anchors, fit, fmt, fast))
+    f.close()
+    return jobs
+
+
+def glob_jobs(pattern, out_dir, anchors, fit="piecewise", fmt="auto",
+              fast=True) -> list:
+    "Matches of pattern, recursive with **, mirrored under out_dir"
+    # Skip matches under out_dir, a previous run's outputs
+    out_root = os.path.join(os.path.realpath(out_dir), "")
+    fns = []
+    n_skipped = 0
+    for fn in sorted(glob.glob(pattern, recursive=True)):
+        if os.path.isfile(fn):
+            if os.path.realpath(fn).startswith(out_root):
+                n_skipped += 1
+            else:
+                fns.append(fn)
+    if n_skipped:
+        sys.stderr.write(f"{n_skipped} matches under {out_dir} skipped\n")
+    jobs = []
+    if fns:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(fn))
+                                   for fn in fns])
+        for fn in fns:
+            rel = os.path.relpath(os.path.abspath(fn), root)
+            fn_out = os.path.join(out_dir, rel)
+            jobs.append((fn, fn_out, anchors, fit, fmt, fast))
+    return jobs
+
+
+def batch_job(job):
+    (fn_in, fn_out, anchors, fit, fmt, fast) = job
+    t0 = time.time()
+    n_lines = 0
+    n_xforms = 0
+    err = None
+    try:
+        if os.path.realpath(fn_out) == os.path.realpath(fn_in):
+            raise ValueError("output would overwrite its input")
+        out_dir = os.path.dirname(fn_out)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        srtlin = SrtLin(None, None, None, None, fn_in, fn_out, quiet=True,
+                        anchors=anchors, fit=fit, fast=fast, fmt=fmt)
+        rc = srtlin.run()
+        n_lines = srtlin.n_lines
+        n_xforms = srtlin.n_xforms
+    except Exception as e:
+        rc = 1
+        err = "%s: %s" % (e.__class__.__name__, e)
+    return (fn_in, fn_out, rc, n_lines, n_xforms, time.time() - t0, err)
+
+
+def run_batch(jobs, n_procs=None, threads=False) -> int:
+    t0 = time.time()
+    n_ok = 0
+    n_lines = 0
+    pool = (multiprocessing.pool.ThreadPool(n_procs) if threads else
+            multiprocessing.Pool(n_procs))
+    for (fn_in, fn_out, rc, lines, xforms, dt, err) in pool.imap_unordered(
+            batch_job, jobs):
+        if rc == 0:
+            n_ok += 1
+            n_lines += lines
+            sys.stdout.write(f"OK   {fn_in} -> {fn_out}  xform/lines = "
+                             f"{xforms}/{lines} {dt:.3f}s\n")
+        else:
+            sys.stdout.write(f"FAIL {fn_in} -> {fn_out}  {err}\n")
+    pool.close()
+    pool.join()
+    dt = time.time() - t0
+    sys.stdout.write(
+        "%d/%d files OK, %d lines in %.2fs: %.1f files/sec %.0f lines/sec\n"
+        % (n_ok, len(jobs), n_lines, dt, len(jobs) / max(dt, 1e-9),
+           n_lines / max(dt, 1e-9)))
+    return 0 if n_ok == len(jobs) else 1
+
+
 def main(argv: [str]) -> int:
     rc = 0
     parser = argparse.ArgumentParser("srtline", "SRT Linear adjuster")
     parser.add_argument(
         "--vidt0",
-        required=True,
         help="Video 1st Time Stamp")
     parser.add_argument(
         "--srtt0",
-        required=True,
         help="Srt input 1st Time Stamp")
     parser.add_argument(
         "--vidt1",
-        required=True,
         help="Video 2nd Time Stamp")
     parser.add_argument(
         "--srtt1",
-        required=True,
         help="Srt input 2nd Time Stamp")
+    parser.add_argument(
+        "-a", "--anchor",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("VIDT", "SRTT"),
+        help="Video and srt input time stamps, repeatable")
+    parser.add_argument(
+        "--anchors",
+        help="File of anchor lines: vidt srtt")
+    parser.add_argument(
+        "--fit",
+        choices=FITS,
+        default="piecewise",
+        help="piecewise: lines between successive anchors, "
+        "lsq: one least-squares line, reporting residuals")
     parser.add_argument(
         "-i", "--input",
-        required=True,
         help="Original .srt file")
     parser.add_argument(
         "-o", "--output",
-        required=True,
         help="Output .srt file")
+    parser.add_argument(
+        "-r", "--reference",
+        help="Correctly timed .srt, to estimate 2 anchors of the input from")
+    parser.add_argument(
+        "--estimate-only",
+        action="store_true",
+        help="With --reference, print the anchors, without output")
+    parser.add_argument(
+        "-f", "--format",
+        choices=("auto",) + tuple(FORMATS),
+        default="auto",
+        help="Subtitle format, auto: by file name extension, else srt")
+    parser.add_argument(
+        "--no-fast-path",
+        dest="fast",
+        action="store_false",
+        help="Parse every line by the general text path")
+    parser.add_argument(
+        "--batch",
+        help="Manifest, lines of: in.srt out.srt vidt0 srtt0 vidt1 srtt1")
+    parser.add_argument(
+        "--glob",
+        help="Input files pattern, ** for a directory tree, "
+        "using the command line anchors")
+    parser.add_argument(
+        "--out-dir",
+        help="With --glob, output tree root")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        help="Batch pool size, default: number of CPUs")
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Batch in a thread pool, rather than processes")
     pa = parser.parse_args(argv)
     vlog(f"Parsed argumets: {pa}")
-    rc = SrtLin(
-        pa.vidt0, pa.srtt0,
-        pa.vidt1, pa.srtt1,
-        pa.input, pa.output).run()
+    anchors = read_anchors(pa.anchors) if pa.anchors is not None else []
+    anchors += [tuple(a) for a in pa.anchor]
+    if pa.vidt0 is not None and pa.srtt0 is not None:
+        anchors.append((pa.vidt0, pa.srtt0))
+    if pa.vidt1 is not None and pa.srtt1 is not None:
+        anchors.append((pa.vidt1, pa.srtt1))
+    if pa.reference is not None:
+        if pa.input is None:
+            parser.error("--reference requires -i/--input")
+        anchors = estimate_anchors(read_cue_starts(pa.reference),
+                                   read_cue_starts(pa.input, pa.format))
+        sys.stdout.write("-a %s %s -a %s %s\n" % (*anchors[0], *anchors[1]))
+        if pa.estimate_only:
+            return rc
+    if pa.batch is not None:
+        rc = run_batch(read_manifest(pa.batch, pa.fit, pa.format, pa.fast),
+                       pa.jobs, pa.threads)
+    elif pa.glob is not None:
+        if len(anchors) < 2 or pa.out_dir is None:
+            parser.error("--glob requires 2 or more anchors and --out-dir")
+        jobs = glob_jobs(pa.glob, pa.out_dir, anchors, pa.fit, pa.format,
+                         pa.fast)
+        rc = run_batch(jobs, pa.jobs, pa.threads)
+    else:
+        if len(anchors) < 2 or pa.input is None or pa.output is None:
+            parser.error("required: 2 or more anchors, from --vidt0 --srtt0 "
+                         "--vidt1 --srtt1, -a/--anchor or --anchors, and "
+                         "-i/--input -o/--output, or --batch, or --glob")
+        rc = SrtLin(
+            pa.vidt0, pa.srtt0,
+            pa.vidt1, pa.srtt1,
+            pa.input, pa.output,
+            anchors=anchors, fit=pa.fit, fast=pa.fast,
+            fmt=pa.format).run()
     return rc;
 
 if __name__ == "__main__":
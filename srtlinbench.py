@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Benchmark srtlin.py fast byte path against the general line path
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import srtlin
+
+ow = sys.stdout.write
+
+ANCHORS = [("00:00:01,000", "00:00:01,200"), ("01:30:00,000", "01:30:05,500")]
+
+
+def make_srt(fn, mb, seed=0):
+    rng = random.Random(seed)
+    words = ["the", "of", "and", "subtitle", "you", "what", "here",
+             "Really?", "Come", "on!", "- No.", "I", "know"]
+    f = open(fn, "w")
+    size = 0
+    ci = 0
+    t = 1000
+    while size < mb * 1000000:
+        ci += 1
+        d = rng.randrange(500, 5000)
+        lines = [str(ci),
+                 f"{srtlin.ms2srttime(t)} --> {srtlin.ms2srttime(t + d)}"]
+        for li in range(rng.randrange(1, 3)):
+            lines.append(" ".join(rng.choice(words)
+                                  for wi in range(rng.randrange(2, 9))))
+        text = "\n".join(lines) + "\n\n"
+        f.write(text)
+        size += len(text)
+        t += d + rng.randrange(0, 4000)
+        if t > 90 * 3600 * 1000:
+            t = 1000
+    f.close()
+
+
+def bench(fn_in, fn_out, repeat):
+    size = os.path.getsize(fn_in)
+    times = {}
+    outputs = {}
+    for (name, fast) in (("general", False), ("fast", True)):
+        best = None
+        for r in range(repeat):
+            fn = f"{fn_out}.{name}"
+            s = srtlin.SrtLin(None, None, None, None, fn_in, fn, quiet=True,
+                              anchors=ANCHORS, fast=fast)
+            t0 = time.time()
+            s.run()
+            dt = time.time() - t0
+            best = dt if best is None else min(best, dt)
+        times[name] = best
+        outputs[name] = fn
+        ow("%-8s %8.3fs %8.1f MB/s %10.0f lines/sec\n" %
+           (name, best, size / 1e6 / best, s.n_lines / best))
+    ow("speedup: %.2fx\n" % (times["general"] / times["fast"]))
+    same = (open(outputs["general"], "rb").read() ==
+            open(outputs["fast"], "rb").read())
+    ow("outputs %s\n" % ("identical" if same else "DIFFER"))
+    for fn in outputs.values():
+        os.unlink(fn)
+    return 0 if same else 1
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        "srtlinbench", "Benchmark srtlin fast path",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-m", "--mb", type=float, default=100,
+                        help="Synthetic corpus size in MB")
+    parser.add_argument("-i", "--input",
+                        help="Existing .srt corpus, instead of synthetic")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="Best of repeated runs")
+    args = parser.parse_args(argv[1:])
+    tmpdir = tempfile.mkdtemp(prefix="srtlinbench-")
+    fn_in = args.input
+    if fn_in is None:
+        fn_in = os.path.join(tmpdir, "corpus.srt")
+        make_srt(fn_in, args.mb)
+    ow("%s: %.1f MB\n" % (fn_in, os.path.getsize(fn_in) / 1e6))
+    rc = bench(fn_in, os.path.join(tmpdir, "out.srt"), args.repeat)
+    if args.input is None:
+        os.unlink(fn_in)
+    os.rmdir(tmpdir)
+    return rc
+
+
+if __name__ == "__main__":
+    rc = main(sys.argv)
+    sys.exit(rc)